@@ -0,0 +1,67 @@
+import hashlib
+import os
+import tempfile
+
+CACHE_DIR = '__pycache__'
+
+
+class Cache(object):
+    """A single artifact derived from a source file, stored on disk.
+
+    The entry lives in a __pycache__ directory next to the source and
+    starts with a digest of the source contents and `tag`, so it is
+    ignored as soon as either of them changes.
+    """
+
+    def __init__(self, source_path, suffix, tag):
+        directory, name = os.path.split(os.path.abspath(source_path))
+        self.path = os.path.join(directory, CACHE_DIR, f'{os.path.splitext(name)[0]}.{suffix}')
+
+        with open(source_path, 'rb') as file:
+            digest = hashlib.sha256(file.read())
+            # entries are as readable as the source, like those of CPython
+            self.mode = (os.fstat(file.fileno()).st_mode | 0o200) & 0o666
+        digest.update(tag.encode())
+        self.key = digest.digest()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        if data[:len(self.key)] != self.key:
+            return None
+        return data[len(self.key):]
+
+    def store(self, data):
+        # write to a temporary file and rename it over the entry, so that
+        # concurrent runs never see a partially written file
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+        except OSError:
+            return  # caching is best-effort
+
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(self.key + data)
+            os.chmod(tmp_path, self.mode)  # mkstemp makes it private
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def source_digest(modules):
+    """Digest of the source of modules, for the tags of entries their code
+    derives, so that the entries go stale whenever that code changes."""
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
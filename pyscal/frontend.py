@@ -1,7 +1,15 @@
+import re
 import sys
 
-from scope import ValueWrapper, VarSymbol
+from objects.errors import PyscalException, PyscalSemanticError
+from objects.tokens import EOF
+from scope import ValueWrapper, FrameScope, VarSymbol, outer_frame
 from helpers import input_word
+from phases.tokenizer import Tokenizer
+from phases.parser import Parser
+from phases.analyzer import Analyzer
+from phases.compiler import Compiler
+import objects.ast as ast
 
 COMMANDS = {
     'help': 'help [cmd] -- print help',
@@ -11,23 +19,92 @@ COMMANDS = {
     'return': 'return -- run until a function returns',
     'list': 'list -- list current function\'s source code',
     'print': 'print [var] -- print a variable\'s  value',
-    'break': 'break [line] -- set a breakpoint on line',
+    'break': 'break [line] [if expr] -- set a breakpoint on line, stopping only when expr is true',
     'delete': 'delete [line] -- remove breakpoint from line',
-    'info': 'info -- show all breakpoints',
+    'watch': 'watch var -- stop whenever an assignment changes var',
+    'unwatch': 'unwatch var -- remove watchpoint from var',
+    'info': 'info -- show all breakpoints and watchpoints',
+    'reload': 'reload -- run the program again from the start of its edited source file',
     'exit': 'exit -- finish this debug session',
 }
 
+# 'break [line] if expr'
+CONDITION_RE = re.compile(r'(.*?)\s+if\b\s*(.*)')
+
+
+class Reload(Exception):
+    """Raised by the `reload` command to stop the program, so that it can
+    be parsed again and run from the start"""
+
+
+def compile_condition(text, scope, frontend):
+    """Compiles the condition of a breakpoint for the frame of scope, with
+    the closure compiler. Function calls are not allowed."""
+    lines = ['']
+    parser = Parser(Tokenizer([text], lines).read_tokens())
+    expr = parser.expr()
+    parser.eat_token(EOF)
+
+    variables = []
+    nodes = [expr]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ast.FuncCall):
+            raise PyscalSemanticError('function calls are not allowed in conditions', node.token.ctx)
+        if isinstance(node, ast.Var):
+            variables.append(node)
+        nodes.extend(node.get_children())
+
+    analyzer = Analyzer()
+    analyzer.current_scope = scope
+    analyzer.visit(expr)
+    return Condition(text, Compiler(frontend).visit(expr), variables)
+
+
+class Condition(object):
+    """Compiled condition of a breakpoint"""
+
+    def __init__(self, text, code, variables):
+        self.text = text
+        self.code = code
+        self.variables = variables
+        self.unset_reported = False
+
+    def check(self, frame):
+        # variables declared after the breakpoint have no value yet
+        for var in self.variables:
+            if outer_frame(frame, var.hops)[var.slot] is None:
+                if not self.unset_reported:
+                    print(f'Condition not met: variable {var.id} has no value yet')
+                    self.unset_reported = True
+                return False
+
+        try:
+            return bool(self.code(frame).value)
+        except PyscalException as e:
+            print(repr(e))
+        except Exception as e:
+            print(f'Error in condition: {e!r}')
+        return True
+
 
 class Frontend:
     def __init__(self, args, debug_mode=False):
         self.args = args
         self.debug_mode = debug_mode
-        self.breakpoints = {}
+        self.breakpoints = {}  # line number -> Condition or None
+        self.watchpoints = {}  # id of a variable's symbol -> its name
+        self.line_scopes = {}
+        self.last_printed = ''
+        self.restart()
+
+    def restart(self):
+        # state of a run, the program stops at its first line
+        self.probes_changed = False
 
         self.cmd = 'step'
         self.cmd_depth = 0
         self.cmd_line_no = None
-        self.last_printed = ''
 
         self.stack = []
         self.current_scope = None
@@ -43,33 +120,66 @@ class Frontend:
         return ValueWrapper('string', input_word())
 
     def enter_func(self, func):
-        if not self.debug_mode:
-            return
         self.stack.append(func)
 
     def leave_func(self):
-        if not self.debug_mode:
-            return
         self.stack.pop()
 
-    def scope_changed(self, new_scope):
-        if not self.debug_mode:
-            return
-        self.current_scope = new_scope
+    def stepping(self):
+        return self.cmd is not None
 
-    def visit_line(self, ctx):
-        if not self.debug_mode:
-            return
+    def probe_lines(self):
+        # lines the interpreter has to report, None for all of them
+        return None if self.stepping() else self.breakpoints.keys()
+
+    def watched(self):
+        return self.watchpoints.keys()
+
+    def reload(self):
+        # breakpoints stay on their lines, but watchpoints belong to the
+        # variables of the old program
+        if self.watchpoints:
+            print(f'Watchpoints deleted: {", ".join(self.watchpoints.values())}')
+            self.watchpoints = {}
+        self.restart()
+
+    def set_line_scopes(self, line_scopes):
+        # scopes of the lines that have statements, for conditions, which
+        # are compiled again when a reloaded program starts
+        self.line_scopes = line_scopes
+
+        for line_no, condition in list(self.breakpoints.items()):
+            if condition is None:
+                continue
+            condition = self.compile_condition(line_no, condition.text)
+            if condition is None:
+                del self.breakpoints[line_no]
+                print(f'Breakpoint deleted: {line_no}')
+            else:
+                self.breakpoints[line_no] = condition
+
+    def visit_line(self, ctx, scope, frame):
         if not self.stack:  # not initialized yet
             return
-        if not self.should_break(ctx.line_no):
+        if not self.should_break(ctx.line_no, frame):
             return
 
+        self.stop(ctx, scope, frame)
+
+    def value_changed(self, symbol_id, old_value, new_value, ctx, scope, frame):
+        if not self.stack:
+            return
+
+        print(f'Watchpoint {self.watchpoints[symbol_id]}: {old_value} -> {new_value}')
+        self.stop(ctx, scope, frame)
+
+    def stop(self, ctx, scope, frame):
         self.ctx = ctx
+        self.current_scope = FrameScope(scope, frame)
         self.print_ctx()
         self.read_cmd()
 
-    def should_break(self, line_no):
+    def should_break(self, line_no, frame):
         if self.cmd_line_no == line_no and len(self.stack) == self.cmd_depth:
             return False
 
@@ -80,31 +190,52 @@ class Frontend:
         elif self.cmd == 'return' and len(self.stack) < self.cmd_depth:
             return True
         elif line_no in self.breakpoints:
-            return True
+            return self.check_condition(self.breakpoints[line_no], frame)
 
         return False
 
+    def compile_condition(self, line_no, text):
+        scope = self.line_scopes.get(line_no)
+        if scope is None:
+            print(f'No statement on line {line_no}')
+            return None
+        try:
+            return compile_condition(text, scope, self)
+        except PyscalException as e:
+            print(repr(e))
+            return None
+
+    def check_condition(self, condition, frame):
+        if condition is None:
+            return True
+        return condition.check(frame)
+
     def print_ctx(self):
         print(f'In function <{self.stack[-1].id}>')
         print(self.ctx)
 
     def read_cmd(self):
         while True:
-            line = input('pyscal-dbg> ').split()
+            text = input('pyscal-dbg> ')
+            line = text.split()
             if not line:
                 continue
 
             cmd = line[0]
+            # a prefix of several commands means the first of them
             cmds = [c for c in COMMANDS if c.startswith(cmd)]
 
             if not cmds:
                 print('Unknown command. Type \'h\' for help')
                 continue
-            if len(cmds) > 1:
-                print('Ambiguous command. Type \'h\' for help')
-                continue
             cmd = cmds[0]
 
+            condition = None
+            if cmd == 'break':
+                match = CONDITION_RE.match(text)
+                if match:
+                    line, condition = match.group(1).split(), match.group(2)
+
             arg = line[1] if len(line) > 1 else None
 
             if cmd in ('break', 'delete'):
@@ -117,23 +248,27 @@ class Frontend:
                 else:
                     arg = self.ctx.line_no
 
-            if self.exec_command(cmd, arg):
+            if self.exec_command(cmd, arg, condition):
                 break
 
-    def exec_command(self, cmd, arg):
+    def exec_command(self, cmd, arg, condition=None):
         if cmd == 'help':
             if arg in COMMANDS:
                 print(COMMANDS[arg])
             else:
                 print('Available commands:')
                 print(f'    {", ".join(COMMANDS.keys())}')
-                print('You can type any unambiguous prefix of a command.')
+                print('You can type any prefix of a command, the first command it fits is used.')
 
         elif cmd == 'continue':
+            if self.stepping():
+                self.probes_changed = True
             self.cmd = self.cmd_depth = self.cmd_line_no = None
             return True
 
         elif cmd in ('step', 'next', 'return'):
+            if not self.stepping():
+                self.probes_changed = True
             self.cmd = cmd
             self.cmd_depth = len(self.stack)
             self.cmd_line_no = self.ctx.line_no
@@ -144,22 +279,49 @@ class Frontend:
 
         elif cmd == 'print':
             arg = self.last_printed = arg or self.last_printed
-            symbol = self.current_scope.lookup(arg)
-            if not isinstance(symbol, VarSymbol):
+            value = self.current_scope.lookup(arg)
+            if value is None:
                 print(f'No variable {repr(arg)} in current scope')
             else:
-                print(f'{arg}: {symbol.value}')
+                print(f'{arg}: {value}')
 
         elif cmd == 'break':
-            self.breakpoints[arg] = True
+            if condition is not None:
+                condition = self.compile_condition(arg, condition)
+                if condition is None:
+                    return False
+            self.breakpoints[arg] = condition
+            if not self.stepping():
+                self.probes_changed = True
             print(f'Breakpoint set: {arg}')
 
         elif cmd == 'delete':
             self.breakpoints.pop(arg)
+            if not self.stepping():
+                self.probes_changed = True
             print(f'Breakpoint deleted: {arg}')
 
+        elif cmd in ('watch', 'unwatch'):
+            symbol = self.current_scope.scope.lookup(arg) if arg else None
+            if not isinstance(symbol, VarSymbol):
+                print(f'No variable {repr(arg)} in current scope')
+            elif cmd == 'watch':
+                self.watchpoints[id(symbol)] = arg
+                self.probes_changed = True
+                print(f'Watchpoint set: {arg}')
+            elif self.watchpoints.pop(id(symbol), None):
+                self.probes_changed = True
+                print(f'Watchpoint deleted: {arg}')
+            else:
+                print(f'No watchpoint on {repr(arg)}')
+
         elif cmd == 'info':
             print(f'Breakpoints: {repr(list(self.breakpoints.keys()))}')
+            if self.watchpoints:
+                print(f'Watchpoints: {repr(list(self.watchpoints.values()))}')
+
+        elif cmd == 'reload':
+            raise Reload()
 
         elif cmd == 'exit':
             sys.exit(0)
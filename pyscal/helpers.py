@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from random import random
 
 
@@ -14,6 +15,14 @@ WORD_GEN = word_gen()
 
 
 class ValueWrapper(object):
+    """A typed runtime value.
+
+    Wrappers are shared freely between variables, constants and the
+    interned instances below, so they must never be modified.
+    """
+
+    __slots__ = ('type', 'value', 'real_type')
+
     def __init__(self, type, value=None, real_type=None):
         self.type = type
         self.real_type = real_type or type
@@ -30,3 +39,62 @@ class ValueWrapper(object):
 
     def __repr__(self):
         return f'<{self.real_type}> {repr(self.value)}'
+
+
+SMALL_INTS = {value: ValueWrapper('int', value) for value in range(-5, 257)}
+BOOLS = (ValueWrapper('int', False), ValueWrapper('int', True))
+DEFAULT_VALUES = {type: ValueWrapper(type) for type in ('int', 'real', 'string', 'any')}
+
+
+def int_value(value):
+    # `value` must be an int, not a bool or a float equal to one
+    wrapper = SMALL_INTS.get(value)
+    if wrapper is None:
+        return ValueWrapper('int', value)
+    return wrapper
+
+
+def bool_value(value):
+    return BOOLS[value]
+
+
+def constant_value(type, value):
+    if type == 'int' and value.__class__ is int:
+        return int_value(value)
+    return ValueWrapper(type, value)
+
+
+def default_value(type):
+    # void defaults are random, so they can not be shared
+    wrapper = DEFAULT_VALUES.get(type)
+    if wrapper is None:
+        return ValueWrapper(type)
+    return wrapper
+
+
+def value_key(value):
+    # equal values of different types or classes (1, 1.0, True) must not
+    # share a key
+    return value.type, value.real_type, value.value.__class__, value.value
+
+
+class LRUCache(object):
+    """A mapping that holds at most `size` items, dropping the least
+    recently used one when full."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
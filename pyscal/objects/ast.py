@@ -1,17 +1,144 @@
-import pprint
+from types import GeneratorType
 
 
 class NodeVisitor(object):
+    """Calls the visit_* method named after the class of a node, or else
+    after its nearest base class that has one (a Program is visited as
+    a FuncDef, an Assignment as a BinaryOp). Methods are looked up once
+    per visitor and node class.
+    """
+
+    handlers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handlers = {}  # node class -> function
+
     def visit(self, node, **kwargs):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node, **kwargs)
+        handler = self.handlers.get(node.__class__)
+        if handler is None:
+            handler = self.find_handler(node.__class__)
+        return handler(self, node, **kwargs)
+
+    @classmethod
+    def find_handler(cls, node_class):
+        for base in node_class.__mro__:
+            handler = getattr(cls, 'visit_' + base.__name__, None)
+            if handler is not None:
+                break
+        else:
+            handler = cls.generic_visit
+        cls.handlers[node_class] = handler
+        return handler
 
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
 
+class IterativeVisitor(NodeVisitor):
+    """Visitor that keeps the nodes being visited on an explicit stack.
+
+    A visit_* method may be a generator: it visits a child by yielding
+    the child, or a generator that visits it, and receives the result
+    (see run). Other visit_* methods are called as usual. The Python
+    stack stays flat however deep the tree is.
+    """
+
+    def visit(self, node, **kwargs):
+        return self.run(super().visit(node, **kwargs))
+
+    def run(self, task):
+        return run(task, super().visit)
+
+
+def run(task, visit=None):
+    """Runs a generator and the generators it yields, without recursion
+
+    A generator yielded by a task becomes a task itself, whatever it
+    returns is sent back. Anything else yielded is passed to visit, or
+    sent straight back without one.
+    """
+    if type(task) is not GeneratorType:
+        return task
+
+    stack = [task]
+    value = None
+    while True:
+        try:
+            item = task.send(value)
+        except StopIteration as e:
+            stack.pop()
+            if not stack:
+                return e.value
+            task = stack[-1]
+            value = e.value
+            continue
+
+        if type(item) is not GeneratorType:
+            if visit is None:
+                value = item
+                continue
+            item = visit(item)
+            if type(item) is not GeneratorType:
+                value = item
+                continue
+
+        stack.append(item)
+        task = item
+        value = None
+
+
+def format_list_repr(list_repr, width=80):
+    """Same as pprint.pformat(list_repr), without recursion"""
+    # lengths of the one line reprs, inner lists first
+    lists = [list_repr]
+    for items in lists:
+        lists.extend(item for item in items if type(item) is list)
+    lengths = {}
+    for items in reversed(lists):
+        length = 2 * len(items)
+        for item in items:
+            length += lengths[id(item)] if type(item) is list else len(repr(item))
+        lengths[id(items)] = length
+
+    # tasks are strings to write and (item, indent, allowance), with no
+    # indent if the item goes on one line
+    result = []
+    tasks = [(list_repr, 0, 0)]
+    while tasks:
+        task = tasks.pop()
+        if type(task) is str:
+            result.append(task)
+            continue
+
+        item, indent, allowance = task
+        if type(item) is not list:
+            result.append(repr(item))
+            continue
+
+        last = len(item) - 1
+        if indent is None or lengths[id(item)] <= width - indent - allowance:
+            parts = ['[']
+            for i, child in enumerate(item):
+                if i:
+                    parts.append(', ')
+                parts.append((child, None, None))
+        else:
+            parts = ['[']
+            delimiter = ',\n' + ' ' * (indent + 1)
+            for i, child in enumerate(item):
+                if i:
+                    parts.append(delimiter)
+                parts.append((child, indent + 1, allowance + 1 if i == last else 1))
+        parts.append(']')
+        tasks.extend(reversed(parts))
+
+    return ''.join(result)
+
+
 class ASTNode(object):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
 
@@ -22,14 +149,24 @@ class ASTNode(object):
         return []
 
     def get_list_repr(self):
-        children = filter(None, self.get_children())
-        return [self] + [child.get_list_repr() for child in children]
+        result = [self]
+        stack = [(self, result)]
+        while stack:
+            node, node_repr = stack.pop()
+            for child in node.get_children():
+                if child:
+                    child_repr = [child]
+                    node_repr.append(child_repr)
+                    stack.append((child, child_repr))
+        return result
 
     def pretty_print(self):
-        return pprint.pformat(self.get_list_repr())
+        return format_list_repr(self.get_list_repr())
 
 
 class FuncDef(ASTNode):
+    __slots__ = ('id', 'ret_type', 'params', 'body', 'symbol')
+
     def __init__(self, token, ret_type, params, body):
         super().__init__(token)
         self.id = token.id
@@ -42,11 +179,15 @@ class FuncDef(ASTNode):
 
 
 class Program(FuncDef):
+    __slots__ = ()
+
     def __init__(self, token, ret_type, params, body):
         super().__init__(token, ret_type, params, body)
 
 
 class Block(ASTNode):
+    __slots__ = ('statements', 'functions', 'scope', 'load')
+
     def __init__(self, token):
         super().__init__(token)
         self.statements = []
@@ -55,8 +196,22 @@ class Block(ASTNode):
     def get_children(self):
         return self.functions + self.statements
 
+    def __getattr__(self, name):
+        # function bodies read by the serializer are decoded on first use
+        if name == 'load':
+            raise AttributeError(name)
+        try:
+            load = self.load
+        except AttributeError:
+            raise AttributeError(name) from None
+        del self.load
+        load(self)
+        return getattr(self, name)
+
 
 class UnaryOp(ASTNode):
+    __slots__ = ('op', 'expr', 'type', 'arg_types', 'value_type', 'impl')
+
     def __init__(self, token, expr):
         super().__init__(token)
         self.op = token.type
@@ -67,6 +222,8 @@ class UnaryOp(ASTNode):
 
 
 class BinaryOp(ASTNode):
+    __slots__ = ('left', 'op', 'right', 'type', 'arg_types', 'value_type', 'impl')
+
     def __init__(self, left, token, right):
         super().__init__(token)
         self.left = left
@@ -78,23 +235,31 @@ class BinaryOp(ASTNode):
 
 
 class Assignment(BinaryOp):
+    __slots__ = ()
+
     def __init__(self, left, token, right):
         super().__init__(left, token, right)
 
 
 class Var(ASTNode):
+    __slots__ = ('id', 'symbol', 'hops', 'slot', 'decl_type')
+
     def __init__(self, token):
         super().__init__(token)
         self.id = token.id
 
 
 class Type(ASTNode):
+    __slots__ = ('id',)
+
     def __init__(self, token):
         super().__init__(token)
         self.id = token.id
 
 
 class Literal(ASTNode):
+    __slots__ = ('value', 'value_type', 'constant')
+
     def __init__(self, token):
         super().__init__(token)
         self.value = token.value
@@ -102,6 +267,8 @@ class Literal(ASTNode):
 
 
 class VarDecl(ASTNode):
+    __slots__ = ('var', 'type', 'symbol', 'slot', 'decl_type')
+
     def __init__(self, var):
         super().__init__(var.token)
         self.var = var
@@ -112,6 +279,8 @@ class VarDecl(ASTNode):
 
 
 class FuncCall(ASTNode):
+    __slots__ = ('id', 'args', 'symbol', 'hops')
+
     def __init__(self, token, args):
         super().__init__(token)
         self.id = token.id
@@ -122,6 +291,8 @@ class FuncCall(ASTNode):
 
 
 class IfStmt(ASTNode):
+    __slots__ = ('expr', 'body', 'next')
+
     def __init__(self, token, expr, body):
         super().__init__(token)
         self.expr = expr
@@ -133,6 +304,8 @@ class IfStmt(ASTNode):
 
 
 class WhileStmt(ASTNode):
+    __slots__ = ('expr', 'body')
+
     def __init__(self, token, expr, body):
         super().__init__(token)
         self.expr = expr
@@ -143,6 +316,8 @@ class WhileStmt(ASTNode):
 
 
 class SpecialStmt(ASTNode):
+    __slots__ = ('type', 'args', 'tail_call')
+
     def __init__(self, token):
         super().__init__(token)
         self.type = token.type
@@ -1,14 +1,28 @@
+import sys
+
+
 class Context(object):
-    def __init__(self, line, line_no, pos):
-        self.line = line
+    """Position of a token, the line is looked up in a table of the source
+    lines shared by all contexts of a file (line 0 is empty)."""
+
+    __slots__ = ('lines', 'line_no', 'pos')
+
+    def __init__(self, lines, line_no, pos):
+        self.lines = lines
         self.line_no = line_no
         self.pos = pos
 
+    @property
+    def line(self):
+        return self.lines[self.line_no]
+
     def __repr__(self):
         return f'{str(self.line_no).ljust(5)}{self.line}'
 
 
 class Token(object):
+    __slots__ = ('type', 'ctx')
+
     def __init__(self, type):
         self.type = type
         self.ctx = None
@@ -18,6 +32,8 @@ class Token(object):
 
 
 class LiteralToken(Token):
+    __slots__ = ('value_type', 'value')
+
     def __init__(self, value_type, value):
         super().__init__(LITERAL)
         self.value_type = value_type
@@ -28,6 +44,8 @@ class LiteralToken(Token):
 
 
 class IDToken(Token):
+    __slots__ = ('id',)
+
     def __init__(self, id):
         super().__init__(ID)
         self.id = id
@@ -36,6 +54,10 @@ class IDToken(Token):
         return f'{self.type}({repr(self.id)})'
 
 
+# Token types are interned, so the names read back by the serializer are
+# the very same objects. Python interns the ones that look like
+# identifiers on its own.
+
 # Keywords
 PROGRAM = 'PROGRAM'
 VAR = 'VAR'
@@ -63,8 +85,8 @@ ID = 'ID'
 PLUS = 'PLUS'
 MINUS = 'MINUS'
 MUL = 'MUL'
-INT_DIV = 'INT-DIV'
-REAL_DIV = 'REAL-DIV'
+INT_DIV = sys.intern('INT-DIV')
+REAL_DIV = sys.intern('REAL-DIV')
 MOD = 'MOD'
 GT = 'GT'
 GTE = 'GTE'
@@ -74,7 +96,7 @@ EQ = 'EQ'
 NEQ = 'NEQ'
 CAST = 'CAST'
 ASSIGN = 'ASSIGN'
-CAST_ASSIGN = 'CAST-ASSIGN'
+CAST_ASSIGN = sys.intern('CAST-ASSIGN')
 
 # Delimiters
 LPAREN = 'LPAREN'
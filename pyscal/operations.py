@@ -1,6 +1,9 @@
+from functools import partial
+import operator
+
 from objects.errors import PyscalTypeError
 from objects.tokens import *
-from scope import ValueWrapper
+from helpers import ValueWrapper, int_value, bool_value
 
 VALID_TYPES = {
     AND: ('int', 'real', 'string'),
@@ -20,6 +23,60 @@ VALID_TYPES = {
     MOD: ('int', 'real'),
 }
 
+TYPES = ('int', 'real', 'string', 'any', 'cast', 'void')
+
+# types whose values are only checked when an operation runs
+DYNAMIC_TYPES = ('any', 'cast')
+
+CONVERTERS = {
+    'int': int,
+    'real': float,
+    'string': str,
+}
+
+
+def identity(value):
+    return value
+
+
+def logical_and(val1, val2):
+    return bool(val1) and bool(val2)
+
+
+def logical_or(val1, val2):
+    return bool(val1) or bool(val2)
+
+
+def logical_xor(val1, val2):
+    return bool(val1) ^ bool(val2)
+
+
+BIN_OP_FUNCS = {
+    AND: logical_and,
+    OR: logical_or,
+    XOR: logical_xor,
+    LT: operator.lt,
+    LTE: operator.le,
+    GT: operator.gt,
+    GTE: operator.ge,
+    EQ: operator.eq,
+    NEQ: operator.ne,
+    PLUS: operator.add,
+    MINUS: operator.sub,
+    MUL: operator.mul,
+    INT_DIV: operator.floordiv,
+    REAL_DIV: operator.truediv,
+    MOD: operator.mod,
+}
+
+UN_OP_FUNCS = {
+    CAST: identity,
+    PLUS: identity,
+    MINUS: operator.neg,
+}
+
+ARITHMETIC_OPS = (PLUS, MINUS, MUL, INT_DIV, REAL_DIV, MOD)
+
 
 def is_implicitly_convertible(type1, type2):
     if type1 == type2:
@@ -60,7 +117,10 @@ def get_assignment_type(op, var_type, expr_type, expr_real_type, ctx=None):
 
 def get_assignment_value(op, var_type, expr, ctx=None):
     type = get_assignment_type(op, var_type, expr.type, expr.real_type, ctx=ctx)
-    return ValueWrapper(type, cast(expr.value, type, ctx=ctx))
+    value = cast(expr.value, type, ctx=ctx)
+    if type == 'int':
+        return int_value(value)
+    return ValueWrapper(type, value)
 
 
 def get_un_op_type(op, type, ctx=None):
@@ -77,15 +137,16 @@ def get_un_op_type(op, type, ctx=None):
 
 
 def get_un_op_value(op, arg, ctx=None):
-    type = get_un_op_type(op, arg.type, ctx=ctx)
-    val = cast(arg.value, type, ctx=ctx)
-
-    if op == MINUS:
-        val = -val
-    elif op == NOT:
-        val = not val
+    entry = UN_OP_TABLE.get((op, arg.type))
+    if entry is None:
+        get_un_op_type(op, arg.type, ctx=ctx)  # raises
 
-    return ValueWrapper(type, val, real_type=arg.real_type)
+    type, func, convert = entry
+    try:
+        return ValueWrapper(type, func(convert(arg.value)), real_type=arg.real_type)
+    except PyscalTypeError as e:
+        e.ctx = ctx
+        raise
 
 
 def get_bin_op_type(op, type1, type2, ctx=None):
@@ -103,43 +164,110 @@ def get_bin_op_type(op, type1, type2, ctx=None):
 
 
 def get_bin_op_value(op, arg1, arg2, ctx=None):
-    type = get_bin_op_type(op, arg1.type, arg2.type, ctx=ctx)
-    val1 = cast(arg1.value, type, ctx=ctx)
-    val2 = cast(arg2.value, type, ctx=ctx)
-    result = None
-
-    if op == AND:
-        result = bool(val1) and bool(val2)
-    elif op == OR:
-        result = bool(val1) or bool(val2)
-    elif op == XOR:
-        result = bool(val1) ^ bool(val2)
-    elif op == LT:
-        result = val1 < val2
-    elif op == LTE:
-        result = val1 <= val2
-    elif op == GT:
-        result = val1 > val2
-    elif op == GTE:
-        result = val1 >= val2
-    elif op == EQ:
-        result = val1 == val2
-    elif op == NEQ:
-        result = val1 != val2
-    elif op == PLUS:
-        result = val1 + val2
-    elif op == MINUS:
-        result = val1 - val2
-    elif op == MUL:
-        result = val1 * val2
-    elif op == INT_DIV:
-        result = val1 // val2
-    elif op == REAL_DIV:
-        result = val1 / val2
-    elif op == MOD:
-        result = val1 % val2
-
-    if op in (PLUS, MINUS, MUL, INT_DIV, REAL_DIV, MOD):
-        return ValueWrapper(type, result)
-    else:
-        return ValueWrapper('int', result)
+    entry = BIN_OP_TABLE.get((op, arg1.type, arg2.type))
+    if entry is None:
+        get_bin_op_type(op, arg1.type, arg2.type, ctx=ctx)  # raises
+
+    type, wrap, func, convert1, convert2 = entry
+    try:
+        return wrap(func(convert1(arg1.value), convert2(arg2.value)))
+    except PyscalTypeError as e:
+        e.ctx = ctx
+        raise
+
+
+def get_conversion(from_type, to_type):
+    if to_type in ('any', 'cast'):
+        return identity
+    if from_type in DYNAMIC_TYPES:
+        # raises without a context, the caller adds it
+        return partial(cast, type=to_type)
+    return CONVERTERS[to_type]
+
+
+def get_wrapper(type, op=None):
+    # comparisons give bools, int arithmetic other than / gives ints,
+    # both have interned wrappers
+    if op is not None and op not in ARITHMETIC_OPS:
+        return bool_value
+    if type == 'int' and op != REAL_DIV:
+        return int_value
+    return partial(ValueWrapper, type)
+
+
+def build_un_op_table():
+    # (op, operand type) -> (result type, implementation, operand conversion)
+    table = {}
+    for op, func in UN_OP_FUNCS.items():
+        for arg_type in TYPES:
+            try:
+                type = get_un_op_type(op, arg_type)
+            except PyscalTypeError:
+                continue
+            table[op, arg_type] = (type, func, get_conversion(arg_type, type))
+    return table
+
+
+def build_bin_op_table():
+    # (op, left type, right type) ->
+    #     (result type, result wrapper, implementation, left conversion, right conversion)
+    table = {}
+    for op, func in BIN_OP_FUNCS.items():
+        for type1 in TYPES:
+            for type2 in TYPES:
+                try:
+                    type = get_bin_op_type(op, type1, type2)
+                except PyscalTypeError:
+                    continue
+                result_type = type if op in ARITHMETIC_OPS else 'int'
+                table[op, type1, type2] = (result_type, get_wrapper(type, op), func,
+                                           get_conversion(type1, type), get_conversion(type2, type))
+    return table
+
+
+UN_OP_TABLE = build_un_op_table()
+BIN_OP_TABLE = build_bin_op_table()
+
+
+# Specialized implementations. The analyzer knows the types of the values
+# every operation gets, so it picks one of these once instead of looking
+# them up on each evaluation. They take the same arguments as the matching
+# get_*_value function minus the leading ones. Operands of a dynamic type
+# go through the generic functions, which check their types at run time.
+
+def assign_converted(wrap, convert, expr, ctx=None):
+    return wrap(convert(expr.value))
+
+
+def un_op_converted(type, func, convert, arg, ctx=None):
+    return ValueWrapper(type, func(convert(arg.value)), real_type=arg.real_type)
+
+
+def bin_op_converted(wrap, func, convert1, convert2, arg1, arg2, ctx=None):
+    return wrap(func(convert1(arg1.value), convert2(arg2.value)))
+
+
+def get_assignment_impl(op, var_type, expr_type):
+    if (
+        op == CAST_ASSIGN
+        or var_type == 'any'
+        or expr_type in DYNAMIC_TYPES
+        or not is_implicitly_convertible(expr_type, var_type)
+    ):
+        return partial(get_assignment_value, op, var_type)
+
+    return partial(assign_converted, get_wrapper(var_type), CONVERTERS[var_type])
+
+
+def get_un_op_impl(op, type):
+    entry = UN_OP_TABLE.get((op, type))
+    if entry is None or type in DYNAMIC_TYPES:
+        return partial(get_un_op_value, op)
+    return partial(un_op_converted, *entry)
+
+
+def get_bin_op_impl(op, type1, type2):
+    entry = BIN_OP_TABLE.get((op, type1, type2))
+    if entry is None or type1 in DYNAMIC_TYPES or type2 in DYNAMIC_TYPES:
+        return partial(get_bin_op_value, op)
+    return partial(bin_op_converted, *entry[1:])
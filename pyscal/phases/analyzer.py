@@ -1,5 +1,6 @@
 from objects.errors import PyscalSemanticError
 from scope import Scope, FuncSymbol, TypeSymbol, VarSymbol
+from helpers import constant_value
 from objects.tokens import *
 import objects.ast as ast
 import operations
@@ -9,16 +10,19 @@ def analyze(ast):
     Analyzer().visit(ast)
 
 
-class Analyzer(ast.NodeVisitor):
+class Analyzer(ast.IterativeVisitor):
     def __init__(self):
         self.current_scope = Scope()
+        self.current_function = None
+        self.functions = []
 
     def error(self, message, token):
         raise PyscalSemanticError(message, token.ctx if token else None)
 
     def visit_Program(self, node):
         self.visit_FuncDef(node)
-        self.visit_FuncBody(node)
+        yield self.visit_FuncBody(node)
+        self.propagate_impurity()
 
     def visit_FuncDef(self, node):
         if self.current_scope.lookup(node.id, current_scope_only=True):
@@ -31,58 +35,122 @@ class Analyzer(ast.NodeVisitor):
         else:
             ret_type = self.get_type(node.ret_type)
 
-        symbol = FuncSymbol(node.id, ret_type, node.params, node.body)
+        symbol = FuncSymbol(node.id, ret_type, node.params, node.body, depth=self.current_scope.depth + 1,
+                            ctx=node.token.ctx)
         self.current_scope.insert(symbol)
+        self.functions.append(symbol)
+        node.symbol = symbol
+
+        # void functions return a random value
+        symbol.pure = ret_type != 'void'
+        symbol.callees = set()
 
     def get_type(self, type_node, default='any'):
         return type_node and self.visit(type_node) or default
 
+    """Purity"""
+
+    # A function is pure when its result depends on its arguments alone and
+    # calling it has no effect besides returning that result: it does no
+    # I/O, does not touch variables of enclosing functions and only calls
+    # pure functions.
+
+    def mark_impure(self):
+        if self.current_function:
+            self.current_function.pure = False
+
+    def propagate_impurity(self):
+        changed = True
+        while changed:
+            changed = False
+            for symbol in self.functions:
+                if symbol.pure and not all(callee.pure for callee in symbol.callees):
+                    symbol.pure = False
+                    changed = True
+
+    """Functions and blocks"""
+
     def visit_FuncBody(self, node):
-        func_symbol = self.current_scope.lookup(node.id)
+        func_symbol = node.symbol
+        outer_function, self.current_function = self.current_function, func_symbol
 
-        self.current_scope = Scope(self.current_scope, ret_type=func_symbol.ret_type)
+        self.current_scope = Scope(self.current_scope, ret_type=func_symbol.ret_type, is_function=True)
         for param in node.params:
-            self.visit(param)
+            self.visit_VarDecl(param)
 
-        self.visit(node.body, create_scope=False)
+        yield self.visit_Block(node.body, create_scope=False)
 
+        func_symbol.frame_size = self.current_scope.frame_size
         self.current_scope = self.current_scope.enclosing_scope
+        self.current_function = outer_function
 
     def visit_Block(self, node, create_scope=True):
         if create_scope:
             self.current_scope = Scope(self.current_scope)
+        node.scope = self.current_scope
 
         for func_def in node.functions:
-            self.visit(func_def)
+            self.visit_FuncDef(func_def)
 
         for func_def in node.functions:
-            self.visit_FuncBody(func_def)
+            yield self.visit_FuncBody(func_def)
 
         for stmt in node.statements:
-            self.visit(stmt)
+            yield stmt
 
         if create_scope:
             self.current_scope = self.current_scope.enclosing_scope
 
+    # Operation nodes get their static result type, the types of the values
+    # their operands evaluate to and the implementation matching those (see
+    # operations.get_*_impl). Value types can differ from static types:
+    # comparisons are typed by their operands but evaluate to ints.
+
+    def get_value_type(self, node, type):
+        return getattr(node, 'value_type', type)
+
     def visit_UnaryOp(self, node):
-        expr_type = self.visit(node.expr)
-        return operations.get_un_op_type(node.op, expr_type, node.token.ctx)
+        expr_type = yield node.expr
+        node.type = operations.get_un_op_type(node.op, expr_type, node.token.ctx)
+
+        arg_type = self.get_value_type(node.expr, expr_type)
+        node.arg_types = (arg_type,)
+        node.value_type = operations.UN_OP_TABLE.get((node.op, arg_type), (node.type,))[0]
+        node.impl = operations.get_un_op_impl(node.op, arg_type)
+        return node.type
 
     def visit_BinaryOp(self, node):
-        left_type = self.visit(node.left)
-        right_type = self.visit(node.right)
-        return operations.get_bin_op_type(node.op, left_type, right_type, node.token.ctx)
+        left_type = yield node.left
+        right_type = yield node.right
+        node.type = operations.get_bin_op_type(node.op, left_type, right_type, node.token.ctx)
+
+        node.arg_types = (self.get_value_type(node.left, left_type), self.get_value_type(node.right, right_type))
+        node.value_type = operations.BIN_OP_TABLE.get((node.op, *node.arg_types), (node.type,))[0]
+        node.impl = operations.get_bin_op_impl(node.op, *node.arg_types)
+        return node.type
 
     def visit_Assignment(self, node):
         var_type = self.visit_Var(node.left)
-        expr_type = self.visit(node.right)
-        return operations.get_assignment_type(node.op, var_type, expr_type, 'any', node.token.ctx)
+        expr_type = yield node.right
+        node.type = operations.get_assignment_type(node.op, var_type, expr_type, 'any', node.token.ctx)
+
+        node.arg_types = (var_type, self.get_value_type(node.right, expr_type))
+        node.impl = operations.get_assignment_impl(node.op, *node.arg_types)
+        return node.type
 
     def visit_Var(self, node):
         symbol = self.current_scope.lookup(node.id)
         if not isinstance(symbol, VarSymbol):
             self.error(f'variable {node.id} not declared', node.token)
 
+        # static address of the variable: frames up the static chain, slot in that frame
+        node.symbol = symbol
+        node.hops = self.current_scope.depth - symbol.depth
+        node.slot = symbol.slot
+        node.decl_type = symbol.decl_type
+
+        if node.hops:
+            self.mark_impure()
         return symbol.decl_type
 
     def visit_Type(self, node):
@@ -92,6 +160,7 @@ class Analyzer(ast.NodeVisitor):
         return symbol.id
 
     def visit_Literal(self, node):
+        node.constant = constant_value(node.value_type, node.value)
         return node.value_type
 
     def visit_VarDecl(self, node):
@@ -104,8 +173,11 @@ class Analyzer(ast.NodeVisitor):
         if self.current_scope.lookup(var_name, current_scope_only=True):
             self.error(f'duplicate identifier {var_name}', node.token)
 
-        var_symbol = VarSymbol(var_name, type_name)
+        var_symbol = VarSymbol(var_name, type_name, self.current_scope.depth, self.current_scope.allocate_slot())
         self.current_scope.insert(var_symbol)
+        node.symbol = var_symbol
+        node.slot = var_symbol.slot
+        node.decl_type = type_name
         return var_symbol
 
     def visit_FuncCall(self, node):
@@ -118,8 +190,14 @@ class Analyzer(ast.NodeVisitor):
         if param_cnt != arg_cnt:
             self.error(f'function {symbol.id} requires {param_cnt} argument(s), but {arg_cnt} given', node.token)
 
+        # the callee's static link is the frame of the function that defines it
+        node.symbol = symbol
+        node.hops = self.current_scope.depth - (symbol.depth - 1)
+        if self.current_function:
+            self.current_function.callees.add(symbol)
+
         for param, arg in zip(symbol.params, node.args):
-            arg_type = self.visit(arg)
+            arg_type = yield arg
             operations.get_assignment_type(ASSIGN, self.get_type(param.type), arg_type, 'any', ctx=arg.token.ctx)
 
         return symbol.ret_type
@@ -127,14 +205,14 @@ class Analyzer(ast.NodeVisitor):
     def visit_IfStmt(self, node):
         while node:
             if node.expr:
-                self.visit(node.expr)
-            self.visit(node.body)
+                yield node.expr
+            yield node.body
             node = node.next
 
     def visit_WhileStmt(self, node):
-        self.visit(node.expr)
+        yield node.expr
         self.current_scope = Scope(self.current_scope, is_loop=True)
-        self.visit(node.body, create_scope=False)
+        yield self.visit_Block(node.body, create_scope=False)
         self.current_scope = self.current_scope.enclosing_scope
 
     def visit_SpecialStmt(self, node):
@@ -143,10 +221,14 @@ class Analyzer(ast.NodeVisitor):
                 self.error(f'{node.type} outside a loop', node.token)
         elif node.type == RETURN:
             if node.args:
-                arg_type = self.visit(node.args[0])
+                arg_type = yield node.args[0]
             else:
                 arg_type = 'void'
             operations.get_assignment_type(ASSIGN, self.current_scope.ret_type, arg_type, 'any', ctx=node.token.ctx)
+
+            # `return f(...)` can reuse the caller's place on the stack
+            node.tail_call = bool(node.args) and isinstance(node.args[0], ast.FuncCall)
         else:
+            self.mark_impure()  # print and read
             for arg in node.args:
-                self.visit(arg)
+                yield arg
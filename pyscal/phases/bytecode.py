@@ -0,0 +1,238 @@
+from helpers import default_value
+from phases.compiler import Function
+from objects.tokens import *
+import objects.ast as ast
+
+
+def compile(ast):
+    return BytecodeCompiler().compile_program(ast)
+
+
+# Opcodes. Every instruction is an (opcode, argument) pair of ints.
+# Variables are addressed by the frame slots assigned by the analyzer:
+# LOAD_LOCAL takes a slot of the current frame directly, the other
+# variable instructions take a tuple from the constant table. UNARY_OP
+# and BINARY_OP take the implementation the analyzer selected.
+LOAD_CONST = 1
+LOAD_LOCAL = 2
+LOAD_VAR = 3
+STORE_LOCAL = 4
+STORE_VAR = 5
+DECLARE_VAR = 6
+UNARY_OP = 7
+BINARY_OP = 8
+POP_TOP = 9
+JUMP = 10
+POP_JUMP_IF_FALSE = 11
+CALL_FUNCTION = 12
+RETURN_VALUE = 13
+RETURN_NONE = 14
+PRINT_VALUE = 15
+READ_VAR = 16
+TAIL_CALL = 17
+
+OPNAMES = {value: name for name, value in list(globals().items()) if name.isupper() and type(value) is int}
+
+
+class CodeObject(object):
+    """Flat bytecode of a single function body.
+
+    `code` holds opcode/argument pairs, jump targets are indices into it.
+    `ctxs` has one entry per instruction with the context to report
+    if that instruction raises.
+    """
+
+    def __init__(self, name, ctx=None, param_ctxs=None):
+        self.name = name
+        self.ctx = ctx
+        self.param_ctxs = param_ctxs or []
+        self.code = []
+        self.ctxs = []
+        self.consts = []
+        self.functions = []  # Functions defined in this body
+
+    def __repr__(self):
+        return f'<code {self.name}, {len(self.ctxs)} instructions>'
+
+    def disassemble(self):
+        lines = [f'Disassembly of {self.name}:']
+
+        for pc in range(0, len(self.code), 2):
+            op, arg = self.code[pc], self.code[pc + 1]
+            line = f'{str(pc).rjust(6)} {OPNAMES[op].ljust(20)}'
+
+            if op in (CALL_FUNCTION, TAIL_CALL):
+                line += f'{arg} ({self.consts[arg][0].id})'
+            elif op in (LOAD_CONST, LOAD_VAR, STORE_LOCAL, STORE_VAR, DECLARE_VAR, READ_VAR, UNARY_OP, BINARY_OP):
+                line += f'{arg} ({repr(self.consts[arg])})'
+            elif op in (LOAD_LOCAL, JUMP, POP_JUMP_IF_FALSE):
+                line += str(arg)
+            lines.append(line)
+
+        for func in self.functions:
+            lines.append('')
+            lines.append(func.body.disassemble())
+
+        return '\n'.join(lines)
+
+
+class BytecodeCompiler(ast.NodeVisitor):
+    """Lowers an analyzed AST into CodeObjects, one per function."""
+
+    def __init__(self):
+        self.code = None
+        self.function = None
+        self.loops = []
+        self.functions = {}
+
+    def compile_program(self, node):
+        return self.visit_FuncDef(node)
+
+    """Emitting"""
+
+    def emit(self, op, arg=0, ctx=None):
+        self.code.code.extend((op, arg))
+        self.code.ctxs.append(ctx)
+        return len(self.code.code) - 2
+
+    def label(self):
+        return len(self.code.code)
+
+    def patch(self, pc, target=None):
+        self.code.code[pc + 1] = self.label() if target is None else target
+
+    def add_const(self, value):
+        self.code.consts.append(value)
+        return len(self.code.consts) - 1
+
+    """Functions and blocks"""
+
+    def get_function(self, symbol):
+        # calls may be compiled before the body of their callee
+        function = self.functions.get(id(symbol))
+        if function is None:
+            function = self.functions[id(symbol)] = Function(symbol)
+        return function
+
+    def visit_FuncDef(self, node):
+        function = self.get_function(node.symbol)
+
+        outer = self.code, self.function, self.loops
+        self.code = CodeObject(node.id, node.token.ctx, [param.token.ctx for param in node.params])
+        self.function = function
+        self.loops = []
+
+        self.visit(node.body)
+        self.emit(RETURN_NONE)
+        function.body = self.code
+
+        self.code, self.function, self.loops = outer
+        return function
+
+    def visit_Block(self, node):
+        for func_def in node.functions:
+            self.code.functions.append(self.visit(func_def))
+
+        for stmt in node.statements:
+            self.visit(stmt)
+            if isinstance(stmt, ast.FuncCall):
+                self.emit(POP_TOP)
+
+    """Expressions"""
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        self.emit(UNARY_OP, self.add_const(node.impl), node.token.ctx)
+
+    def visit_BinaryOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY_OP, self.add_const(node.impl), node.token.ctx)
+
+    def visit_Assignment(self, node):
+        var = node.left
+        self.visit(node.right)
+        if var.hops == 0:
+            self.emit(STORE_LOCAL, self.add_const((var.slot, node.impl)), node.token.ctx)
+        else:
+            self.emit(STORE_VAR, self.add_const((var.hops, var.slot, node.impl)), node.token.ctx)
+
+    def visit_Var(self, node):
+        if node.hops == 0:
+            self.emit(LOAD_LOCAL, node.slot)
+        else:
+            self.emit(LOAD_VAR, self.add_const((node.hops, node.slot)))
+
+    def visit_Literal(self, node):
+        self.emit(LOAD_CONST, self.add_const(node.constant))
+
+    def visit_VarDecl(self, node):
+        type_name = 'int' if node.decl_type == 'any' else node.decl_type
+        self.emit(DECLARE_VAR, self.add_const((node.slot, default_value(type_name))))
+
+    def visit_FuncCall(self, node, op=CALL_FUNCTION):
+        for arg in node.args:
+            self.visit(arg)
+        call = (self.get_function(node.symbol), node.hops, len(node.args), [arg.token.ctx for arg in node.args])
+        self.emit(op, self.add_const(call))
+
+    """Statements"""
+
+    def visit_IfStmt(self, node):
+        exits = []
+        while node:
+            if node.expr is None:
+                self.visit(node.body)
+                break
+
+            self.visit(node.expr)
+            skip = self.emit(POP_JUMP_IF_FALSE)
+            self.visit(node.body)
+            if node.next:
+                exits.append(self.emit(JUMP))
+            self.patch(skip)
+            node = node.next
+
+        for pc in exits:
+            self.patch(pc)
+
+    def visit_WhileStmt(self, node):
+        start = self.label()
+        self.visit(node.expr)
+        exit = self.emit(POP_JUMP_IF_FALSE)
+
+        self.loops.append((start, [exit]))
+        self.visit(node.body)
+        self.emit(JUMP, start)
+        _, breaks = self.loops.pop()
+
+        for pc in breaks:
+            self.patch(pc)
+
+    def visit_SpecialStmt(self, node):
+        if node.type in (BREAK, CONTINUE):
+            start, breaks = self.loops[-1]
+            if node.type == BREAK:
+                breaks.append(self.emit(JUMP))
+            else:
+                self.emit(JUMP, start)
+
+        elif node.type == RETURN:
+            # the callee's return converts to the same type as ours would,
+            # so its frame can simply replace the current one
+            if node.tail_call and node.args[0].symbol.ret_type == self.function.ret_type:
+                self.visit_FuncCall(node.args[0], op=TAIL_CALL)
+            elif node.args:
+                self.visit(node.args[0])
+                self.emit(RETURN_VALUE, ctx=node.token.ctx)
+            else:
+                self.emit(RETURN_NONE, ctx=node.token.ctx)
+
+        elif node.type == PRINT:
+            for arg in node.args:
+                self.visit(arg)
+                self.emit(PRINT_VALUE)
+
+        elif node.type == READ:
+            for arg in node.args:
+                self.emit(READ_VAR, self.add_const((arg.hops, arg.slot, arg.decl_type)), arg.token.ctx)
@@ -0,0 +1,311 @@
+from objects.errors import PyscalSemanticError
+from helpers import default_value, value_key, LRUCache
+from scope import outer_frame
+from phases.interpreter import Return, TailCall, DEFAULT_MEMO_SIZE
+from objects.tokens import *
+import objects.ast as ast
+import operations
+
+
+def interpret(ast, frontend, memo_size=DEFAULT_MEMO_SIZE):
+    return Compiler(frontend, memo_size=memo_size).visit(ast)().value
+
+
+class Function(object):
+    """A function as compiled code calls it.
+
+    Parameters are (slot, type) pairs, the body is whatever the compiler
+    made of the function's block, and memo holds results of a pure
+    function (see Interpreter.get_memo), if any.
+    """
+
+    __slots__ = ('id', 'ret_type', 'params', 'frame_size', 'body', 'memo')
+
+    def __init__(self, symbol, memo=None):
+        self.id = symbol.id
+        self.ret_type = symbol.ret_type
+        self.params = [(param.slot, param.decl_type) for param in symbol.params]
+        self.frame_size = symbol.frame_size
+        self.body = None
+        self.memo = memo
+
+
+class Compiler(ast.NodeVisitor):
+    """Turns an analyzed AST into a tree of closures.
+
+    Every node is visited once, at compile time. The closures take the
+    current frame as their only argument and have everything else bound
+    in advance, so no dispatch happens while the program runs.
+    """
+
+    def __init__(self, frontend, memo_size=DEFAULT_MEMO_SIZE):
+        self.frontend = frontend
+        self.functions = {}
+        self.memo_size = memo_size
+
+    def visit_Program(self, node):
+        program = self.visit_FuncDef(node)
+        get_args = self.frontend.get_args
+        call = self.make_call([param.token.ctx for param in node.params], op=CAST_ASSIGN)
+        ctx = node.token.ctx
+
+        def run():
+            args = get_args()
+
+            param_cnt = len(program.params)
+            arg_cnt = len(args)
+            if param_cnt != arg_cnt:
+                raise PyscalSemanticError(f'program {program.id} requires {param_cnt} argument(s), '
+                                          f'but {arg_cnt} given', ctx)
+
+            return call(program, args, None)
+
+        return run
+
+    def get_function(self, symbol):
+        # calls may be compiled before the body of their callee
+        function = self.functions.get(id(symbol))
+        if function is None:
+            memo = LRUCache(self.memo_size) if symbol.pure and self.memo_size else None
+            function = self.functions[id(symbol)] = Function(symbol, memo)
+        return function
+
+    def visit_FuncDef(self, node):
+        function = self.get_function(node.symbol)
+        function.body = self.visit_Block(node.body)
+        return function
+
+    def make_call(self, arg_ctxs, op=ASSIGN):
+        get_assignment_value = operations.get_assignment_value
+
+        def call(function, args, static_link):
+            # see Interpreter.call
+            conversions = []
+            ctxs, assign_op = arg_ctxs, op
+
+            while True:
+                frame = [None] * function.frame_size
+                frame[0] = static_link
+
+                for (slot, type), arg, ctx in zip(function.params, args, ctxs):
+                    frame[slot] = get_assignment_value(assign_op, type, arg, ctx=ctx)
+
+                signal = function.body(frame)
+
+                if signal.__class__ is not TailCall:
+                    break
+
+                if signal.func_symbol.ret_type != function.ret_type:
+                    conversions.append((function.ret_type, signal.ctx))
+                function, args, ctxs, static_link = signal.func_symbol, signal.args, signal.arg_ctxs, signal.static_link
+                assign_op = ASSIGN
+
+            if signal is None:
+                ret_value, ctx = None, None
+            else:
+                ret_value, ctx = signal.value, signal.ctx
+
+            if ret_value is None:
+                ret_value = default_value(function.ret_type)
+            ret_value = get_assignment_value(ASSIGN, function.ret_type, ret_value, ctx=ctx)
+
+            for ret_type, ctx in reversed(conversions):
+                ret_value = get_assignment_value(ASSIGN, ret_type, ret_value, ctx=ctx)
+            return ret_value
+
+        return call
+
+    def visit_Block(self, node):
+        for func_def in node.functions:
+            self.visit(func_def)
+
+        statements = [self.statement(stmt) for stmt in node.statements]
+
+        def block(frame):
+            for stmt in statements:
+                signal = stmt(frame)
+                if signal is not None:
+                    return signal
+
+        return block
+
+    def statement(self, node):
+        code = self.visit(node)
+
+        if isinstance(node, ast.FuncCall):  # discard the result
+            def stmt(frame):
+                code(frame)
+            return stmt
+
+        return code
+
+    def visit_UnaryOp(self, node):
+        impl = node.impl
+        expr = self.visit(node.expr)
+        ctx = node.token.ctx
+
+        def un_op(frame):
+            return impl(expr(frame), ctx=ctx)
+
+        return un_op
+
+    def visit_BinaryOp(self, node):
+        impl = node.impl
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        ctx = node.token.ctx
+
+        def bin_op(frame):
+            return impl(left(frame), right(frame), ctx=ctx)
+
+        return bin_op
+
+    def visit_Assignment(self, node):
+        impl = node.impl
+        hops, slot = node.left.hops, node.left.slot
+        expr = self.visit(node.right)
+        ctx = node.token.ctx
+
+        if hops == 0:
+            def assignment(frame):
+                frame[slot] = impl(expr(frame), ctx=ctx)
+        else:
+            def assignment(frame):
+                outer_frame(frame, hops)[slot] = impl(expr(frame), ctx=ctx)
+
+        return assignment
+
+    def visit_Var(self, node):
+        hops, slot = node.hops, node.slot
+
+        if hops == 0:
+            def var(frame):
+                return frame[slot]
+        else:
+            def var(frame):
+                return outer_frame(frame, hops)[slot]
+
+        return var
+
+    def visit_Literal(self, node):
+        value = node.constant
+
+        def literal(frame):
+            return value
+
+        return literal
+
+    def visit_VarDecl(self, node):
+        slot = node.slot
+        type_name = 'int' if node.decl_type == 'any' else node.decl_type
+
+        value = default_value(type_name)
+
+        def var_decl(frame):
+            frame[slot] = value
+
+        return var_decl
+
+    def visit_FuncCall(self, node):
+        function = self.get_function(node.symbol)
+        hops = node.hops
+        args = [self.visit(arg) for arg in node.args]
+        call = self.make_call([arg.token.ctx for arg in node.args])
+
+        memo = function.memo
+        if memo is None:
+            def func_call(frame):
+                return call(function, [arg(frame) for arg in args], outer_frame(frame, hops))
+        else:
+            def func_call(frame):
+                values = [arg(frame) for arg in args]
+                key = tuple(value_key(value) for value in values)
+                ret_value = memo.get(key)
+                if ret_value is None:
+                    ret_value = call(function, values, outer_frame(frame, hops))
+                    memo.put(key, ret_value)
+                return ret_value
+
+        return func_call
+
+    def visit_IfStmt(self, node):
+        branches = []
+        while node:
+            expr = self.visit(node.expr) if node.expr else None
+            branches.append((expr, self.visit(node.body)))
+            node = node.next
+
+        def if_stmt(frame):
+            for expr, body in branches:
+                if expr is None or expr(frame).value:
+                    return body(frame)
+
+        return if_stmt
+
+    def visit_WhileStmt(self, node):
+        expr = self.visit(node.expr)
+        body = self.visit(node.body)
+
+        def while_stmt(frame):
+            while expr(frame).value:
+                signal = body(frame)
+                if signal is not None:
+                    if signal is BREAK:
+                        break
+                    if signal is not CONTINUE:
+                        return signal
+
+        return while_stmt
+
+    def visit_SpecialStmt(self, node):
+        if node.type in (BREAK, CONTINUE):
+            signal = BREAK if node.type == BREAK else CONTINUE
+
+            def loop_stmt(frame):
+                return signal
+
+            return loop_stmt
+
+        elif node.type == RETURN:
+            ctx = node.token.ctx
+
+            if node.tail_call:
+                call = node.args[0]
+                function = self.get_function(call.symbol)
+                hops = call.hops
+                args = [self.visit(arg) for arg in call.args]
+                arg_ctxs = [arg.token.ctx for arg in call.args]
+
+                def tail_call_stmt(frame):
+                    return TailCall(function, [arg(frame) for arg in args], arg_ctxs, outer_frame(frame, hops), ctx)
+
+                return tail_call_stmt
+
+            expr = self.visit(node.args[0]) if node.args else None
+
+            def return_stmt(frame):
+                return Return(expr and expr(frame), ctx)
+
+            return return_stmt
+
+        elif node.type == PRINT:
+            print_ = self.frontend.print
+            args = [self.visit(arg) for arg in node.args]
+
+            def print_stmt(frame):
+                for arg in args:
+                    print_(arg(frame))
+
+            return print_stmt
+
+        elif node.type == READ:
+            get_assignment_value = operations.get_assignment_value
+            read = self.frontend.read
+            args = [(arg.hops, arg.slot, arg.decl_type, arg.token.ctx) for arg in node.args]
+
+            def read_stmt(frame):
+                for hops, slot, type, ctx in args:
+                    expr = read()
+                    outer_frame(frame, hops)[slot] = get_assignment_value(CAST_ASSIGN, type, expr, ctx=ctx)
+
+            return read_stmt
@@ -0,0 +1,222 @@
+from objects.errors import PyscalSyntaxError
+from objects.tokens import *
+from phases.tokenizer import Tokenizer
+from phases.parser import Parser
+
+
+class SourceLine(object):
+    """A line of source together with its tokens.
+
+    The tokens are scanned once, when the line first shows up, and are
+    replayed by every later parse that sees the same line. INDENT and
+    DEDENT tokens depend on the lines around, so only the indentation
+    is kept, and the INDENT token once it has been made.
+    """
+
+    def __init__(self, text, line_no, line_table):
+        self.text = text
+        self.indent = None
+        self.indent_error = None
+        self.tokens = []
+        self.error = None
+        self.indent_token = None
+
+        scanner = Tokenizer(None, line_table)
+        scanner.set_line(text, line_no)
+        try:
+            self.indent = scanner.line_indent()
+            if self.indent is not None:
+                # errors are raised once the tokens before them are used
+                for token in scanner.scan_line(self.indent):
+                    self.tokens.append(token)
+        except PyscalSyntaxError as e:
+            if self.indent is None:
+                self.indent = 0
+                self.indent_error = e
+            else:
+                self.error = e
+
+    def shift(self, delta):
+        for token in self.tokens:
+            token.ctx.line_no += delta
+        if self.indent_token:
+            self.indent_token.ctx.line_no += delta
+        for error in (self.indent_error, self.error):
+            if error:
+                error.ctx.line_no += delta
+
+
+class LineTokenizer(Tokenizer):
+    """Replays the tokens of scanned lines, adding INDENT and DEDENT
+
+    The parser can skip the rest of a function with skip_to, the lines
+    it skips produce no tokens.
+    """
+
+    def __init__(self, lines, line_table):
+        super().__init__(None, line_table)
+        self.source_lines = lines
+        self.index = 0
+
+    def skip_to(self, index, indent_level):
+        # continues as if a block opened at indent_level has been read up
+        # to line index, the next line closes it
+        self.index = index
+        self.indent_stack.append(indent_level)
+
+    def read_tokens(self):
+        lines = self.source_lines
+        while self.index < len(lines):
+            line = lines[self.index]
+            self.index += 1
+            if line.indent is None:
+                continue
+
+            index = self.index
+            self.set_line(line.text, index)
+            if line.indent_error:
+                raise line.indent_error
+
+            for token in self.check_indent(line.indent):
+                if token.type == INDENT:
+                    if line.indent_token is None:
+                        token.ctx = self.get_ctx(line.indent)
+                        line.indent_token = token
+                    token = line.indent_token
+                else:
+                    token.ctx = self.get_ctx(line.indent)
+                yield token
+
+            for token in line.tokens:
+                yield token
+                if self.index != index:
+                    break  # skipped
+            else:
+                if line.error:
+                    raise line.error
+
+        if lines:
+            self.set_line(lines[-1].text, len(lines))
+
+        for token in self.check_indent(0):
+            token.ctx = self.get_ctx(self.line_length)
+            yield token
+
+        token = Token(EOF)
+        token.ctx = self.get_ctx(self.line_length)
+        yield token
+
+
+class ReusingParser(Parser):
+    """Parser that takes function definitions from an earlier parse
+
+    functions maps the line of a DEF to the FuncDef parsed from it and
+    the last line of its body, for every DEF that starts its line.
+    """
+
+    def __init__(self, scanner, functions):
+        super().__init__(scanner.read_tokens())
+        self.scanner = scanner
+        self.functions = functions
+
+    def func_definition(self):
+        token = self.current_token
+        line_no = token.ctx.line_no
+        lines = self.scanner.source_lines
+        starts_line = lines[line_no - 1].tokens[0] is token
+
+        if starts_line and line_no in self.functions:
+            node, end = self.functions[line_no]
+            if self.ends_at(line_no, end):
+                self.scanner.skip_to(end, self.body_indent(line_no))
+                self.current_token = next(self.tokens)
+                self.eat_token(DEDENT)
+                return node
+
+        node = yield super().func_definition()
+        if starts_line:
+            self.functions[line_no] = (node, self.body_end(line_no))
+        return node
+
+    def ends_at(self, line_no, end):
+        # the body ends at the first line indented no deeper than its DEF
+        lines = self.scanner.source_lines
+        indent = lines[line_no - 1].indent
+        return next_indent(lines, end) <= indent
+
+    def body_indent(self, line_no):
+        return next_indent(self.scanner.source_lines, line_no)
+
+    def body_end(self, line_no):
+        # the closing DEDENT belongs to the line after the body, or to the
+        # last line of the file
+        lines = self.scanner.source_lines
+        indent = lines[line_no - 1].indent
+        end = self.last_token.ctx.line_no
+        line = lines[end - 1]
+        if line.indent is not None and line.indent <= indent:
+            end -= 1
+        while lines[end - 1].indent is None:
+            end -= 1
+        return end
+
+
+def next_indent(lines, index):
+    # indentation of the first line with tokens from index on, 0 at the end
+    while index < len(lines):
+        if lines[index].indent is not None:
+            return lines[index].indent
+        index += 1
+    return 0
+
+
+class IncrementalParser(object):
+    """Parses successive versions of the same file.
+
+    Only the lines that differ from the previous version are scanned
+    again, and every function definition whose lines are all unchanged
+    is taken from the previous AST instead of being parsed again. The
+    lines that moved are renumbered in place, so the previous AST must
+    not be used after the next call to parse, and it must not have been
+    restructured by the optimizer.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.line_table = ['']  # shared by all contexts, see Context
+        self.functions = {}
+
+    def parse(self, lines):
+        new_texts = [line.strip('\n') for line in lines]
+        old_lines = self.lines
+        old_cnt, new_cnt = len(old_lines), len(new_texts)
+
+        # the edit lies between the unchanged head and tail
+        limit = min(old_cnt, new_cnt)
+        head = 0
+        while head < limit and old_lines[head].text == new_texts[head]:
+            head += 1
+        tail = 0
+        while tail < limit - head and old_lines[old_cnt - tail - 1].text == new_texts[new_cnt - tail - 1]:
+            tail += 1
+
+        delta = new_cnt - old_cnt
+        new_lines = old_lines[:head]
+        self.line_table[1:] = new_texts
+        new_lines.extend(SourceLine(new_texts[i], i + 1, self.line_table) for i in range(head, new_cnt - tail))
+        tail_lines = old_lines[old_cnt - tail:]
+        if delta:
+            for line in tail_lines:
+                line.shift(delta)
+        new_lines.extend(tail_lines)
+
+        functions = {}
+        for line_no, (node, end) in self.functions.items():
+            if end <= head:
+                functions[line_no] = (node, end)
+            elif line_no > old_cnt - tail:
+                functions[line_no + delta] = (node, end + delta)
+
+        self.lines = new_lines
+        self.functions = functions
+        return ReusingParser(LineTokenizer(new_lines, self.line_table), functions).program()
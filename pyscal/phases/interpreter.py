@@ -1,41 +1,101 @@
 from objects.errors import PyscalSemanticError
-from helpers import ValueWrapper
-from scope import Scope, FuncSymbol, VarSymbol
+from helpers import default_value, value_key, LRUCache
+from scope import outer_frame
 from objects.tokens import *
 import objects.ast as ast
 import operations
 
 
-def interpret(ast, frontend):
-    return Interpreter(frontend).visit(ast).value
+DEFAULT_MEMO_SIZE = 1024
 
 
-class ReturnException(Exception):
+def interpret(ast, frontend, memo_size=DEFAULT_MEMO_SIZE, tracer=None):
+    if frontend.debug_mode:
+        interpreter = DebugInterpreter(frontend, memo_size=memo_size)
+    elif tracer:
+        interpreter = TracingInterpreter(frontend, tracer, memo_size=memo_size)
+    else:
+        interpreter = Interpreter(frontend, memo_size=memo_size)
+    return interpreter.visit(ast).value
+
+
+class Return(object):
+    """Completion signal of a `return` statement.
+
+    Statements evaluate to None when they complete normally, to BREAK or
+    CONTINUE for loop control, or to an instance of this class. Blocks
+    stop at the first signal and hand it to their parent.
+    """
+
+    __slots__ = ('value', 'ctx')
+
     def __init__(self, value, ctx):
         self.value = value
         self.ctx = ctx
 
 
-class LoopException(Exception):
-    def __init__(self, type):
-        self.type = type
+class TailCall(object):
+    """Completion signal of a `return` whose value is a function call.
+
+    The call is made by the caller's caller, so that tail recursion runs
+    in constant stack space.
+    """
+
+    __slots__ = ('func_symbol', 'args', 'arg_ctxs', 'static_link', 'ctx')
+
+    def __init__(self, func_symbol, args, arg_ctxs, static_link, ctx):
+        self.func_symbol = func_symbol
+        self.args = args
+        self.arg_ctxs = arg_ctxs
+        self.static_link = static_link
+        self.ctx = ctx
+
+
+class Probe(ast.ASTNode):
+    """Statement the debugger may stop at, see DebugInterpreter"""
+
+    __slots__ = ('stmt', 'scope')
+
+    def __init__(self, stmt, scope):
+        super().__init__(stmt.token)
+        self.stmt = stmt
+        self.scope = scope
+
+    def get_children(self):
+        return [self.stmt]
+
+
+class Watch(Probe):
+    """Assignment to a variable the debugger watches"""
+
+    __slots__ = ()
 
 
 class Interpreter(ast.NodeVisitor):
-    def __init__(self, frontend):
-        self.frontend = frontend
-        self.current_scope = Scope()
+    """Tree-walking interpreter.
 
-    def enter_scope(self, **kwargs):
-        self.current_scope = Scope(self.current_scope, **kwargs)
-        self.frontend.scope_changed(self.current_scope)
+    It tells the frontend nothing about lines, scopes and calls; runs
+    under the debugger use DebugInterpreter, which does.
+    """
 
-    def leave_scope(self):
-        self.current_scope = self.current_scope.enclosing_scope
-        self.frontend.scope_changed(self.current_scope)
+    def __init__(self, frontend, memo_size=DEFAULT_MEMO_SIZE):
+        self.frontend = frontend
+        self.frame = None
+        self.tail_calls = True
+        self.memo_size = memo_size
+        self.memos = {}
+
+    def get_memo(self, func_symbol):
+        # results of pure functions, by argument values
+        if not func_symbol.pure or not self.memo_size:
+            return None
+        memo = self.memos.get(id(func_symbol))
+        if memo is None:
+            memo = self.memos[id(func_symbol)] = LRUCache(self.memo_size)
+        return memo
 
     def visit_Program(self, node):
-        program = self.visit_FuncDef(node)
+        program = node.symbol
         args = self.frontend.get_args()
 
         param_cnt = len(program.params)
@@ -44,131 +104,280 @@ class Interpreter(ast.NodeVisitor):
             raise PyscalSemanticError(f'program {program.id} requires {param_cnt} argument(s), but {arg_cnt} given',
                                       node.token.ctx)
 
-        return self.call(program, args, node.params, op=CAST_ASSIGN)
-
-    def visit_FuncDef(self, node):
-        if isinstance(node, ast.Program):
-            ret_type = 'int'
-        else:
-            if node.ret_type:
-                ret_type = self.visit(node.ret_type)
-            else:
-                ret_type = 'any'
-
-        symbol = FuncSymbol(node.id, ret_type, node.params, node.body)
-
-        self.current_scope.insert(symbol)
-        return symbol
+        return self.call(program, args, [param.token.ctx for param in node.params], None, op=CAST_ASSIGN)
 
     def visit_Block(self, node, create_scope=True):
-        if create_scope:
-            self.enter_scope()
-
-        for func_def in node.functions:
-            self.visit(func_def)
-
-        try:
-            for stmt in node.statements:
-                self.frontend.visit_line(stmt.token.ctx)
-                self.visit(stmt)
-        finally:
-            if create_scope:
-                self.leave_scope()
+        # functions are bound statically by the analyzer and all blocks of
+        # a function share its frame, so there is nothing to set up
+        for stmt in node.statements:
+            signal = self.visit(stmt)
+            if signal is not None and not isinstance(stmt, ast.FuncCall):  # calls give values, not signals
+                return signal
+        return None
 
     def visit_UnaryOp(self, node):
         expr = self.visit(node.expr)
-        return operations.get_un_op_value(node.op, expr, ctx=node.token.ctx)
+        return node.impl(expr, ctx=node.token.ctx)
 
     def visit_BinaryOp(self, node):
         left = self.visit(node.left)
         right = self.visit(node.right)
-        return operations.get_bin_op_value(node.op, left, right, ctx=node.token.ctx)
+        return node.impl(left, right, ctx=node.token.ctx)
 
     def visit_Assignment(self, node):
-        var = self.current_scope.lookup(node.left.id)
+        var = node.left
+        frame = outer_frame(self.frame, var.hops)
         expr = self.visit(node.right)
-        var.value = operations.get_assignment_value(node.op, var.decl_type, expr, ctx=node.token.ctx)
+        frame[var.slot] = node.impl(expr, ctx=node.token.ctx)
 
     def visit_Var(self, node):
-        symbol = self.current_scope.lookup(node.id)
-        return symbol.value
+        return outer_frame(self.frame, node.hops)[node.slot]
 
     def visit_Type(self, node):
         return node.id
 
     def visit_Literal(self, node):
-        return ValueWrapper(node.value_type, node.value)
+        return node.constant
 
     def visit_VarDecl(self, node):
-        type_name = node.type and node.type.id or 'any'
-        var_symbol = VarSymbol(node.var.id, type_name)
-        self.current_scope.insert(var_symbol)
-        return var_symbol
+        type_name = 'int' if node.decl_type == 'any' else node.decl_type
+        self.frame[node.slot] = default_value(type_name)
 
     def visit_FuncCall(self, node):
-        symbol = self.current_scope.lookup(node.id)
         args = [self.visit(arg) for arg in node.args]
-        return self.call(symbol, args, node.args)
 
-    def call(self, func_symbol, args, arg_nodes, op=ASSIGN):
-        self.enter_scope()
+        memo = self.get_memo(node.symbol)
+        if memo is None:
+            return self.call(node.symbol, args, [arg.token.ctx for arg in node.args], outer_frame(self.frame, node.hops))
 
-        for param, arg, node in zip(func_symbol.params, args, arg_nodes):
-            param_symbol = self.visit(param)
-            param_symbol.value = operations.get_assignment_value(op, param_symbol.decl_type, arg, ctx=node.token.ctx)
+        key = tuple(value_key(arg) for arg in args)
+        ret_value = memo.get(key)
+        if ret_value is None:
+            ret_value = self.call(node.symbol, args, [arg.token.ctx for arg in node.args],
+                                  outer_frame(self.frame, node.hops))
+            memo.put(key, ret_value)
+        return ret_value
 
-        ret_value = None
-        ctx = None
+    def call(self, func_symbol, args, arg_ctxs, static_link, op=ASSIGN):
+        # return types of functions that made tail calls, with the contexts
+        # of those returns, for types that differ from their callee's
+        conversions = []
 
-        self.frontend.enter_func(func_symbol)
+        while True:
+            frame = [None] * func_symbol.frame_size
+            frame[0] = static_link
 
-        try:
-            self.visit(func_symbol.body, create_scope=False)
-        except ReturnException as e:
-            ret_value = e.value
-            ctx = e.ctx
-        finally:
-            self.leave_scope()
+            for param, arg, ctx in zip(func_symbol.params, args, arg_ctxs):
+                frame[param.slot] = operations.get_assignment_value(op, param.decl_type, arg, ctx=ctx)
 
-        self.frontend.leave_func()
+            signal = self.run_body(func_symbol, frame)
+
+            if signal.__class__ is not TailCall:
+                break
+
+            if signal.func_symbol.ret_type != func_symbol.ret_type:
+                conversions.append((func_symbol.ret_type, signal.ctx))
+            func_symbol, args, arg_ctxs, static_link = signal.func_symbol, signal.args, signal.arg_ctxs, signal.static_link
+            op = ASSIGN
+
+        if signal is None:
+            ret_value, ctx = None, None
+        else:
+            ret_value, ctx = signal.value, signal.ctx
 
         if ret_value is None:
-            ret_value = ValueWrapper(func_symbol.ret_type)
-        return operations.get_assignment_value(ASSIGN, func_symbol.ret_type, ret_value, ctx=ctx)
+            ret_value = default_value(func_symbol.ret_type)
+        ret_value = operations.get_assignment_value(ASSIGN, func_symbol.ret_type, ret_value, ctx=ctx)
+
+        for ret_type, ctx in reversed(conversions):
+            ret_value = operations.get_assignment_value(ASSIGN, ret_type, ret_value, ctx=ctx)
+        return ret_value
+
+    def run_body(self, func_symbol, frame):
+        caller_frame, self.frame = self.frame, frame
+        signal = self.visit_Block(func_symbol.body, create_scope=False)
+        self.frame = caller_frame
+        return signal
 
     def visit_IfStmt(self, node):
         while node:
             if node.expr is None or self.visit(node.expr).value:
-                self.visit(node.body, )
-                break
+                return self.visit(node.body)
             node = node.next
 
     def visit_WhileStmt(self, node):
         while self.visit(node.expr).value:
-            try:
-                self.visit(node.body, )
-            except LoopException as e:
-                if e.type == CONTINUE:
-                    continue
-                elif e.type == BREAK:
+            signal = self.visit(node.body)
+            if signal is not None:
+                if signal is BREAK:
                     break
-                else:
-                    raise
+                if signal is not CONTINUE:
+                    return signal
 
     def visit_SpecialStmt(self, node):
         if node.type in (BREAK, CONTINUE):
-            raise LoopException(node.type)
+            # signals are compared by identity, and types of unpickled nodes
+            # are equal to the constants but not the same objects
+            return BREAK if node.type == BREAK else CONTINUE
         elif node.type == RETURN:
-            if node.args:
+            if node.tail_call and self.tail_calls:
+                call = node.args[0]
+                args = [self.visit(arg) for arg in call.args]
+                return TailCall(call.symbol, args, [arg.token.ctx for arg in call.args],
+                                outer_frame(self.frame, call.hops), node.token.ctx)
+            elif node.args:
                 ret_value = self.visit(node.args[0])
             else:
                 ret_value = None
-            raise ReturnException(ret_value, node.token.ctx)
+            return Return(ret_value, node.token.ctx)
         elif node.type == PRINT:
             for arg in node.args:
                 self.frontend.print(self.visit(arg))
         elif node.type == READ:
             for arg in node.args:
-                var = self.current_scope.lookup(arg.id)
+                frame = outer_frame(self.frame, arg.hops)
                 expr = self.frontend.read()
-                var.value = operations.get_assignment_value(CAST_ASSIGN, var.decl_type, expr, ctx=arg.token.ctx)
+                frame[arg.slot] = operations.get_assignment_value(CAST_ASSIGN, arg.decl_type, expr, ctx=arg.token.ctx)
+
+
+class DebugInterpreter(Interpreter):
+    """Interpreter that lets the frontend stop at lines.
+
+    The statements the frontend may stop at are wrapped in probes: those
+    on breakpoint lines while the program runs on, all of them while it
+    is stepped through. Other statements run as in the plain interpreter.
+    """
+
+    def __init__(self, frontend, memo_size=DEFAULT_MEMO_SIZE):
+        super().__init__(frontend, memo_size=0)
+        # the debugger has to see every call
+        self.tail_calls = False
+        self.lines = {}  # line number -> (statements, index, scope) of its statements
+        self.assignments = {}  # id of a variable's symbol -> (statements, index, scope) of assignments to it
+        self.probes = []  # (statements, index, replaced statement) of the probes in place
+
+    def visit_Program(self, node):
+        nodes = [node]
+        while nodes:
+            child = nodes.pop()
+            if isinstance(child, ast.Block):
+                for i, stmt in enumerate(child.statements):
+                    entry = (child.statements, i, child.scope)
+                    self.lines.setdefault(stmt.token.ctx.line_no, []).append(entry)
+                    if isinstance(stmt, ast.Assignment):
+                        self.assignments.setdefault(id(stmt.left.symbol), []).append(entry)
+            nodes.extend(c for c in child.get_children() if c)
+
+        self.frontend.set_line_scopes({line_no: entries[0][2] for line_no, entries in self.lines.items()})
+        self.instrument()
+        try:
+            return super().visit_Program(node)
+        finally:
+            # the debugger may reload the program and keep parts of the tree
+            self.remove_probes()
+
+    def remove_probes(self):
+        for statements, i, stmt in reversed(self.probes):
+            statements[i] = stmt
+        self.probes = []
+
+    def instrument(self):
+        self.remove_probes()
+
+        # statements replaced while their block runs are seen by its loop
+        for symbol_id in self.frontend.watched():
+            for statements, i, scope in self.assignments.get(symbol_id, ()):
+                self.add_probe(Watch, statements, i, scope)
+
+        lines = self.frontend.probe_lines()
+        for line_no in self.lines if lines is None else lines:
+            for statements, i, scope in self.lines.get(line_no, ()):
+                self.add_probe(Probe, statements, i, scope)
+        self.frontend.probes_changed = False
+
+    def add_probe(self, probe_class, statements, i, scope):
+        self.probes.append((statements, i, statements[i]))
+        statements[i] = probe_class(statements[i], scope)
+
+    def visit_Probe(self, node):
+        stmt = node.stmt
+        self.frontend.visit_line(node.token.ctx, node.scope, self.frame)
+        if self.frontend.probes_changed:
+            self.instrument()
+            stmt = self.rewatch(stmt, node.scope)
+
+        signal = self.visit(stmt)
+        return None if isinstance(stmt, ast.FuncCall) else signal
+
+    def rewatch(self, stmt, scope):
+        # the statement about to run follows the new watchpoints too
+        if isinstance(stmt, Watch):
+            stmt = stmt.stmt
+        if isinstance(stmt, ast.Assignment) and id(stmt.left.symbol) in self.frontend.watched():
+            stmt = Watch(stmt, scope)
+        return stmt
+
+    def visit_Watch(self, node):
+        var = node.stmt.left
+        frame = outer_frame(self.frame, var.hops)
+        old_value = frame[var.slot]
+        self.visit(node.stmt)
+
+        new_value = frame[var.slot]
+        if old_value is None or value_key(old_value) != value_key(new_value):
+            self.frontend.value_changed(id(var.symbol), old_value, new_value, node.token.ctx, node.scope, self.frame)
+            if self.frontend.probes_changed:
+                self.instrument()
+
+    def run_body(self, func_symbol, frame):
+        self.frontend.enter_func(func_symbol)
+        signal = super().run_body(func_symbol, frame)
+        self.frontend.leave_func()
+        return signal
+
+
+class TracingInterpreter(Interpreter):
+    """Interpreter that reports every line, call and input or output to a
+    tracer (see tracer.Tracer)"""
+
+    def __init__(self, frontend, tracer, memo_size=DEFAULT_MEMO_SIZE):
+        # the tracer has to see every call
+        super().__init__(TracedFrontend(frontend, tracer), memo_size=0)
+        self.tracer = tracer
+
+    def visit_Block(self, node, create_scope=True):
+        visit_line = self.tracer.visit_line
+        for stmt in node.statements:
+            visit_line(stmt.token.ctx)
+            signal = self.visit(stmt)
+            if signal is not None and not isinstance(stmt, ast.FuncCall):  # calls give values, not signals
+                return signal
+        return None
+
+    def run_body(self, func_symbol, frame):
+        self.tracer.enter_func(func_symbol)
+        signal = super().run_body(func_symbol, frame)
+        self.tracer.leave_func()
+        return signal
+
+
+class TracedFrontend(object):
+    """Frontend that reports its input and output to a tracer"""
+
+    def __init__(self, frontend, tracer):
+        self.frontend = frontend
+        self.tracer = tracer
+
+    def get_args(self):
+        return self.frontend.get_args()
+
+    def print(self, wrapper):
+        self.tracer.enter_io('print')
+        self.frontend.print(wrapper)
+        self.tracer.leave_io()
+
+    def read(self):
+        self.tracer.enter_io('read')
+        value = self.frontend.read()
+        self.tracer.leave_io()
+        return value
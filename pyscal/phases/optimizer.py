@@ -0,0 +1,176 @@
+from objects.errors import PyscalException
+from objects.tokens import *
+import objects.ast as ast
+
+
+def optimize(ast):
+    Optimizer().optimize(ast)
+
+
+class Optimizer(ast.IterativeVisitor):
+    """Simplifies an analyzed AST in place.
+
+    - operations whose operands are all constant are evaluated with the
+      implementation the analyzer picked for them;
+    - variables assigned exactly once, by a constant initializer, are
+      replaced by that constant;
+    - if branches with constant conditions are resolved;
+    - statements after return, break and continue are dropped.
+
+    Visiting an expression returns the node that should replace it.
+    """
+
+    def __init__(self):
+        self.writes = {}
+        self.constants = {}
+
+    def optimize(self, node):
+        self.count_writes(node)
+        self.visit(node)
+
+    def count_writes(self, node):
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, ast.Assignment):
+                vars = [node.left]
+            elif isinstance(node, ast.SpecialStmt) and node.type == READ:
+                vars = node.args
+            else:
+                vars = []
+
+            for var in vars:
+                self.writes[var.symbol] = self.writes.get(var.symbol, 0) + 1
+
+            nodes.extend(child for child in node.get_children() if child)
+
+    def make_literal(self, node, value):
+        token = LiteralToken(value.type, value.value)
+        token.ctx = node.token.ctx
+        literal = ast.Literal(token)
+        literal.constant = value
+        return literal
+
+    def fold(self, node, *args):
+        if not all(isinstance(arg, ast.Literal) for arg in args):
+            return node
+
+        try:
+            value = node.impl(*(arg.constant for arg in args), ctx=node.token.ctx)
+        except (PyscalException, ArithmeticError):
+            return node  # fail at run time, as without optimization
+
+        return self.make_literal(node, value)
+
+    """Functions and blocks"""
+
+    def visit_FuncDef(self, node):
+        yield node.body
+
+    def visit_Block(self, node):
+        for func_def in node.functions:
+            yield func_def
+
+        statements = []
+        for stmt in node.statements:
+            stmt = yield stmt
+            if stmt is None:
+                continue
+
+            if statements:
+                self.propagate(statements[-1], stmt)
+            statements.append(stmt)
+
+            if isinstance(stmt, ast.SpecialStmt) and stmt.type in (RETURN, BREAK, CONTINUE):
+                break  # the rest is unreachable
+
+        node.statements = statements
+        return node
+
+    def propagate(self, decl, init):
+        # a declaration is directly followed by its initializer, so reads
+        # of the variable can only happen after it
+        if (
+            isinstance(decl, ast.VarDecl)
+            and isinstance(init, ast.Assignment)
+            and init.left.symbol is decl.symbol
+            and isinstance(init.right, ast.Literal)
+            and self.writes.get(decl.symbol) == 1
+        ):
+            try:
+                self.constants[decl.symbol] = init.impl(init.right.constant, ctx=init.token.ctx)
+            except PyscalException:
+                pass
+
+    """Expressions"""
+
+    def visit_UnaryOp(self, node):
+        node.expr = yield node.expr
+        return self.fold(node, node.expr)
+
+    def visit_BinaryOp(self, node):
+        node.left = yield node.left
+        node.right = yield node.right
+        return self.fold(node, node.left, node.right)
+
+    def visit_Assignment(self, node):
+        node.right = yield node.right
+        return node
+
+    def visit_Var(self, node):
+        value = self.constants.get(node.symbol)
+        if value is None:
+            return node
+        return self.make_literal(node, value)
+
+    def visit_Literal(self, node):
+        return node
+
+    def visit_VarDecl(self, node):
+        return node
+
+    def visit_FuncCall(self, node):
+        args = []
+        for arg in node.args:
+            args.append((yield arg))
+        node.args = args
+        return node
+
+    """Statements"""
+
+    def visit_IfStmt(self, node):
+        branches = []
+        while node:
+            if node.expr is not None:
+                node.expr = yield node.expr
+            yield node.body
+
+            if node.expr is None or isinstance(node.expr, ast.Literal) and node.expr.constant.value:
+                if not branches:
+                    return node.body  # always taken
+                node.expr = None
+                branches.append(node)
+                break
+            if not isinstance(node.expr, ast.Literal):
+                branches.append(node)
+            node = node.next
+
+        if not branches:
+            return None  # never taken
+
+        for branch, next in zip(branches, branches[1:] + [None]):
+            branch.next = next
+        return branches[0]
+
+    def visit_WhileStmt(self, node):
+        node.expr = yield node.expr
+        yield node.body
+        return node
+
+    def visit_SpecialStmt(self, node):
+        if node.type != READ:
+            args = []
+            for arg in node.args:
+                args.append((yield arg))
+            node.args = args
+        return node
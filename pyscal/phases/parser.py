@@ -1,7 +1,31 @@
 from objects.errors import PyscalSyntaxError
 from objects.ast import *
+from objects.ast import run
 from objects.tokens import *
 
+# Binding powers of the operators, higher binds tighter. NOT takes a
+# whole rel-expr, so it binds between the logical and the relational
+# operators.
+LOGICAL_BP = 1
+NOT_BP = 2
+RELATIONAL_BP = 3
+ADDITIVE_BP = 4
+MULTIPLICATIVE_BP = 5
+PREFIX_BP = 6
+
+BINARY_BP = {
+    AND: LOGICAL_BP, OR: LOGICAL_BP, XOR: LOGICAL_BP,
+    LT: RELATIONAL_BP, LTE: RELATIONAL_BP, GT: RELATIONAL_BP,
+    GTE: RELATIONAL_BP, EQ: RELATIONAL_BP, NEQ: RELATIONAL_BP,
+    PLUS: ADDITIVE_BP, MINUS: ADDITIVE_BP,
+    MUL: MULTIPLICATIVE_BP, INT_DIV: MULTIPLICATIVE_BP, REAL_DIV: MULTIPLICATIVE_BP, MOD: MULTIPLICATIVE_BP,
+}
+
+UNARY_BP = {
+    NOT: NOT_BP,
+    PLUS: PREFIX_BP, MINUS: PREFIX_BP, CAST: PREFIX_BP,
+}
+
 
 def parse(tokens):
     return Parser(tokens).program()
@@ -19,10 +43,13 @@ class Parser(object):
         token = self.last_token or self.current_token
         raise PyscalSyntaxError(message, token.ctx)
 
+    def advance(self):
+        self.last_token = self.current_token
+        self.current_token = next(self.tokens, None)
+
     def try_eat(self, *token_types):
         if self.current_token.type in token_types:
-            self.last_token = self.current_token
-            self.current_token = next(self.tokens, None)
+            self.advance()
             return True
         return False
 
@@ -32,12 +59,6 @@ class Parser(object):
         else:
             self.error(f'expected one of: {", ".join(token_types)}')
 
-    def bin_op_expr(self, op_types, arg_scanner, factory=BinaryOp):
-        node = arg_scanner()
-        while self.try_eat(*op_types):
-            node = factory(node, self.last_token, arg_scanner())
-        return node
-
     """Program"""
 
     def program(self):
@@ -47,7 +68,7 @@ class Parser(object):
         self.eat_token(PROGRAM)
         name, params, ret_type = self.func_signature()
         self.eat_token(COLON)
-        body = self.block()
+        body = run(self.block())
         self.eat_token(EOF)
         return Program(name, ret_type, params, body)
 
@@ -61,6 +82,9 @@ class Parser(object):
                     | if-statement | while-statement
                     | special-statement
                     | PASS
+
+        Compound statements come back as generators, to be run by the
+        caller (see objects.ast.run), so that nesting costs no recursion.
         """
         token = self.current_token
 
@@ -102,7 +126,7 @@ class Parser(object):
         """
         node = Block(self.eat_token(INDENT))
         while not self.try_eat(DEDENT):
-            stmt = self.statement()
+            stmt = yield self.statement()
             if type(stmt) is list:
                 node.statements.extend(stmt)
             elif isinstance(stmt, FuncDef):
@@ -120,21 +144,21 @@ class Parser(object):
         token = self.eat_token(IF)
         expr = self.expr()
         self.eat_token(COLON)
-        body = self.block()
+        body = yield self.block()
         first_node = node = IfStmt(token, expr, body)
 
         while self.try_eat(ELIF):
             token = self.last_token
             expr = self.expr()
             self.eat_token(COLON)
-            body = self.block()
+            body = yield self.block()
             node.next = IfStmt(token, expr, body)
             node = node.next
 
         if self.try_eat(ELSE):
             token = self.last_token
             self.eat_token(COLON)
-            body = self.block()
+            body = yield self.block()
             node.next = IfStmt(token, None, body)
 
         return first_node
@@ -146,7 +170,7 @@ class Parser(object):
         token = self.eat_token(WHILE)
         expr = self.expr()
         self.eat_token(COLON)
-        body = self.block()
+        body = yield self.block()
         return WhileStmt(token, expr, body)
 
     def print_statement(self):
@@ -174,53 +198,78 @@ class Parser(object):
     def expr(self):
         """
         expr ::= rel-expr {(AND | OR | XOR) rel-expr}
-        """
-        return self.bin_op_expr([AND, OR, XOR], self.rel_expr)
-
-    def rel_expr(self):
-        """
         rel-expr ::= [NOT] arith-expr {(LT | LTE | GT | GTE | EQ | NEQ) arith-expr}
-        """
-        if self.try_eat(NOT):
-            token = self.last_token
-            expr = self.bin_op_expr([LT, LTE, GT, GTE, EQ, NEQ], self.arith_expr)
-            return UnaryOp(token, expr)
-        return self.bin_op_expr([LT, LTE, GT, GTE, EQ, NEQ], self.arith_expr)
-
-    def arith_expr(self):
-        """
         arith-expr ::= term {(PLUS | MINUS) term}
-        """
-        return self.bin_op_expr([PLUS, MINUS], self.term)
-
-    def term(self):
-        """
         term ::= factor {(MUL | INT-DIV | REAL-DIV | MOD) factor}
-        """
-        return self.bin_op_expr([MUL, INT_DIV, REAL_DIV, MOD], self.factor)
-
-    def factor(self):
-        """
         factor ::= PLUS factor | MINUS factor | CAST factor
                  | LPAREN expr RPAREN
                  | literal
                  | variable
                  | func-call
-        """
-        if self.try_eat(PLUS, MINUS, CAST):
-            node = UnaryOp(self.last_token, self.factor())
-        elif self.try_eat(LPAREN):
-            node = self.expr()
-            self.eat_token(RPAREN)
-        elif self.try_eat(LITERAL):
-            node = Literal(self.last_token)
-        else:
-            self.eat_token(ID)
-            if self.current_token.type == LPAREN:
-                node = self.func_call(self.last_token)
+
+        Parsed by precedence climbing with explicit stacks, so that the
+        nesting depth costs no recursion.
+        """
+        operands = []  # left operands of the binary operators
+        operators = []  # (token, binding power, is unary), None for LPAREN
+        rel_start = True  # a NOT may follow
+
+        while True:
+            token = self.current_token
+            type = token.type
+
+            # operand, with its prefix operators
+            if type in UNARY_BP and (rel_start or type != NOT):
+                self.advance()
+                operators.append((token, UNARY_BP[type], True))
+                rel_start = False
+                continue
+            if type == LPAREN:
+                self.advance()
+                operators.append(None)
+                rel_start = True
+                continue
+
+            if type == LITERAL:
+                self.advance()
+                node = Literal(token)
             else:
-                node = Var(self.last_token)
+                self.eat_token(ID)
+                if self.current_token.type == LPAREN:
+                    node = self.func_call(token)
+                else:
+                    node = Var(token)
+
+            # closing parentheses and the operator after the operand
+            while True:
+                token = self.current_token
+                type = token.type
+                bp = BINARY_BP.get(type, 0)
+
+                while operators:
+                    operator = operators[-1]
+                    if operator is None or operator[1] < bp:
+                        break
+                    operators.pop()
+                    if operator[2]:
+                        node = UnaryOp(operator[0], node)
+                    else:
+                        node = BinaryOp(operands.pop(), operator[0], node)
+
+                if bp or type != RPAREN or not operators:
+                    break
+                self.advance()
+                operators.pop()
+
+            if not bp:
+                break
+            self.advance()
+            operators.append((token, bp, False))
+            operands.append(node)
+            rel_start = bp == LOGICAL_BP
 
+        if operators:
+            self.eat_token(RPAREN)
         return node
 
     """Variables"""
@@ -270,7 +319,7 @@ class Parser(object):
         self.eat_token(DEF)
         name, params, ret_type = self.func_signature()
         self.eat_token(COLON)
-        body = self.block()
+        body = yield self.block()
         return FuncDef(name, ret_type, params, body)
 
     def func_signature(self):
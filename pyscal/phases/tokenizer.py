@@ -1,198 +1,140 @@
 import ast
+import re
 
 from objects.errors import PyscalSyntaxError
 from objects.tokens import *
 
+SYMBOLS = {**ONE_CHAR_SYMBOLS, **TWO_CHAR_SYMBOLS}
+
+SPACE_RE = re.compile(r'\s*')
+
+# Matches the whitespace before a token and the token, the name of the
+# group that matched tells its kind. Two char symbols come first so that
+# they win over their one char prefixes.
+TOKEN_RE = re.compile(r'\s*(?:' + '|'.join([
+    r'(?P<NUMBER>\d+(?:\.\d*)?)',
+    r'(?P<ID>[^\W\d]\w*)',
+    r"(?P<STRING>'(?:[^'\\]|\\.)*')",
+    '(?P<SYMBOL>' + '|'.join(re.escape(sym) for sym in [*TWO_CHAR_SYMBOLS, *ONE_CHAR_SYMBOLS]) + ')',
+    '(?P<COMMENT>' + re.escape(COMMENT_START) + '.*)',
+    '$',
+]) + ')')
+
 
 class Tokenizer(object):
-    def __init__(self, lines):
-        self.lines = lines
-        self.current_line = None
-        self.current_char = None
+    """Lexical analyzer (also known as scanner or tokenizer)
+
+    Breaks the source apart into tokens, one line at a time. Each token
+    is found by a single match of TOKEN_RE.
+    """
 
-        self.eof = False
-        self.pos = 0
+    def __init__(self, lines, line_table=None):
+        self.lines = lines
+        # every line read so far, by line number, shared by the contexts
+        self.line_table = [''] if line_table is None else line_table
+        self.current_line = ''
         self.line_no = 0
+        # contexts point just past their token, but never past the end of
+        # the line; before the first line they point at column 1
+        self.line_length = 1
 
-        self.line_start = True
-        self.indent_level = 0
         self.indent_stack = [0]
-        self.bad_indent = False
-
-    def error(self, message):
-        raise PyscalSyntaxError(message, self.get_ctx())
-
-    def get_ctx(self):
-        return Context(self.current_line or '', self.line_no, self.pos + 1)
-
-    def has_next_char(self):
-        return self.pos + 1 < len(self.current_line)
-
-    def next_char(self):
-        if self.has_next_char():
-            self.pos += 1
-            self.indent_level += 1
-            self.current_char = self.current_line[self.pos]
-        else:
-            self.current_char = None  # signal end of line
-
-    def next_line(self):
-        next_line = next(self.lines, None)
-        if next_line:
-            self.current_line = next_line.strip('\n')
-            self.line_no += 1
-            self.pos = self.indent_level = -1
-            self.next_char()
-        else:
-            self.indent_level = 0
-            self.eof = True
-
-        self.line_start = True
-        self.bad_indent = False
-
-    def check_indent(self):
-        """"""
-        if self.bad_indent:
-            self.error('invalid indentation (only space characters are allowed)')
-
-        if self.indent_level > self.indent_stack[-1]:
-            self.indent_stack.append(self.indent_level)
-            return Token(INDENT)
-
-        if self.indent_level < self.indent_stack[-1]:
+
+    def error(self, message, pos):
+        raise PyscalSyntaxError(message, self.get_ctx(pos))
+
+    def get_ctx(self, pos):
+        return Context(self.line_table, self.line_no, min(pos + 1, self.line_length))
+
+    def check_indent(self, indent_level):
+        if indent_level > self.indent_stack[-1]:
+            self.indent_stack.append(indent_level)
+            yield Token(INDENT)
+
+        while indent_level < self.indent_stack[-1]:
             self.indent_stack.pop()
-            if self.indent_level > self.indent_stack[-1]:
-                self.error('unexpected indent')
-            return Token(DEDENT)
-
-        return None
-
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            if self.line_start and self.current_char != ' ':
-                self.bad_indent = True
-            self.next_char()
-
-    def skip_comment(self):
-        while self.current_char is not None:
-            self.next_char()
-
-    def read_id(self):
-        result = ''
-        while self.current_char is not None and (
-                self.current_char.isalnum() or
-                self.current_char == '_'
-        ):
-            result += self.current_char
-            self.next_char()
-
-        if result in KEYWORDS:
-            return Token(KEYWORDS[result])
-        else:
-            return IDToken(result)
-
-    def read_number(self):
-        result = ''
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.next_char()
-
-        if self.current_char == '.':
-            result += self.current_char
-            self.next_char()
-
-            while self.current_char is not None and self.current_char.isdigit():
-                result += self.current_char
-                self.next_char()
-
-            token = LiteralToken('real', float(result))
-        else:
-            token = LiteralToken('int', int(result))
-
-        if self.current_char is not None and self.current_char.isalpha():
-            self.error('invalid number literal')
-
-        return token
-
-    def read_string(self):
-        result = ''
-        self.next_char()  # consume opening quote
-        while self.current_char != STRING_QUOTE:
-            if self.current_char is None:
-                self.error('string literal not closed')
-
-            if self.current_char == STRING_ESCAPE and self.has_next_char():
-                result += self.current_char
-                self.next_char()
-
-            result += self.current_char
-            self.next_char()
-
-        self.next_char()  # consume closing quote
-        result = ast.literal_eval(STRING_QUOTE + result + STRING_QUOTE)
-        return LiteralToken('string', result)
-
-    def read_token(self):
-        """Lexical analyzer (also known as scanner or tokenizer)
-
-        This method is responsible for breaking a sentence
-        apart into tokens. One token at a time.
-        """
-        while not self.eof:
-            if self.current_char is None:
-                self.next_line()
-                continue
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
-            if self.current_char == COMMENT_START:
-                self.skip_comment()
-                continue
-            break
-
-        if self.line_start:
-            token = self.check_indent()
-            if token:
-                return token
-
-        if self.eof:
-            return Token(EOF)
-
-        self.line_start = False
-
-        if self.current_char.isalpha() or self.current_char == '_':
-            return self.read_id()
-
-        if self.current_char.isdigit():
-            return self.read_number()
-
-        if self.current_char == STRING_QUOTE:
-            return self.read_string()
-
-        if self.has_next_char():
-            sym = self.current_char + self.current_line[self.pos + 1]
-            if sym in TWO_CHAR_SYMBOLS:
-                self.next_char()
-                self.next_char()
-                return Token(TWO_CHAR_SYMBOLS[sym])
-
-        sym = self.current_char
-        if sym in ONE_CHAR_SYMBOLS:
-            self.next_char()
-            return Token(ONE_CHAR_SYMBOLS[sym])
-
-        self.error('invalid character: ' + self.current_char)
-
-    def next_token(self):
-        token = self.read_token()
-        token.ctx = self.get_ctx()
-        return token
+            if indent_level > self.indent_stack[-1]:
+                self.error('unexpected indent', indent_level)
+            yield Token(DEDENT)
+
+    def set_line(self, line, line_no):
+        self.current_line = line
+        self.line_no = line_no
+        self.line_length = len(line)
+
+    def line_indent(self):
+        """Indentation of the current line, None if it has no tokens"""
+        line = self.current_line
+        pos = SPACE_RE.match(line).end()
+        if pos == len(line) or line.startswith(COMMENT_START, pos):
+            return None  # nothing but whitespace and comments
+
+        if line[:pos].strip(' '):
+            self.error('invalid indentation (only space characters are allowed)', pos)
+        return pos
+
+    def read_line(self):
+        pos = self.line_indent()
+        if pos is None:
+            return
+
+        for token in self.check_indent(pos):
+            token.ctx = self.get_ctx(pos)
+            yield token
+
+        yield from self.scan_line(pos)
+
+    def scan_line(self, pos):
+        line = self.current_line
+        while True:
+            match = TOKEN_RE.match(line, pos)
+            if match is None:
+                pos = SPACE_RE.match(line, pos).end()
+                if line[pos] == STRING_QUOTE:
+                    self.error('string literal not closed', len(line))
+                self.error('invalid character: ' + line[pos], pos)
+
+            kind = match.lastgroup
+            if kind is None or kind == 'COMMENT':
+                return  # end of line
+
+            text = match.group(kind)
+            start, pos = match.span(kind)
+
+            if kind == 'ID':
+                if not (text[0].isalpha() or text[0] == '_'):
+                    self.error('invalid character: ' + text[0], start)
+                token = Token(KEYWORDS[text]) if text in KEYWORDS else IDToken(text)
+            elif kind == 'NUMBER':
+                if pos < len(line) and line[pos].isalpha():
+                    self.error('invalid number literal', pos)
+                if '.' in text:
+                    token = LiteralToken('real', float(text))
+                else:
+                    token = LiteralToken('int', int(text))
+            elif kind == 'STRING':
+                token = LiteralToken('string', ast.literal_eval(text))
+            else:
+                token = Token(SYMBOLS[text])
+
+            token.ctx = self.get_ctx(pos)
+            yield token
+
+    def read_tokens(self):
+        for line in self.lines:
+            line = line.strip('\n')
+            self.line_table.append(line)
+            self.set_line(line, self.line_no + 1)
+            yield from self.read_line()
+
+        for token in self.check_indent(0):
+            token.ctx = self.get_ctx(self.line_length)
+            yield token
+
+        token = Token(EOF)
+        token.ctx = self.get_ctx(self.line_length)
+        yield token
 
 
 def tokenize(text):
-    tokenizer = Tokenizer(text)
-    while True:
-        token = tokenizer.next_token()
-        yield token
-        if token.type == EOF:
-            break
+    return Tokenizer(text).read_tokens()
@@ -0,0 +1,407 @@
+import builtins
+import marshal
+import math
+import sys
+
+from objects.errors import PyscalSemanticError
+from helpers import ValueWrapper
+from scope import Scope, Symbol
+from objects.tokens import *
+import objects.ast as ast
+import operations
+
+VERSION = 2
+CACHE_TAG = f'transpiler-{VERSION}-{sys.implementation.cache_tag}'
+
+CONCRETE_TYPES = ('int', 'real', 'string')
+DEFAULT_VALUES = {'int': '0', 'real': '0', 'string': "''", 'any': "ValueWrapper('int')"}
+DEFAULT_RETURNS = {'int': '0', 'real': '0.0', 'string': "''", 'any': "ValueWrapper('any', 0)",
+                   'void': "ValueWrapper('void')"}
+
+LOGIC_OPS = {AND: '&', OR: '|', XOR: '^'}
+COMPARISON_OPS = {LT: '<', LTE: '<=', GT: '>', GTE: '>=', EQ: '==', NEQ: '!='}
+ARITHMETIC_OPS = {PLUS: '+', MINUS: '-', MUL: '*', INT_DIV: '//', REAL_DIV: '/', MOD: '%'}
+
+# names the generated code expects to find in its globals
+RUNTIME = {
+    'Context': Context,
+    'ValueWrapper': ValueWrapper,
+    'PyscalSemanticError': PyscalSemanticError,
+    'cast': operations.cast,
+    'get_assignment_value': operations.get_assignment_value,
+    'get_un_op_value': operations.get_un_op_value,
+    'get_bin_op_value': operations.get_bin_op_value,
+}
+
+
+def transpile(ast):
+    return Transpiler().transpile(ast)
+
+
+def interpret(ast, frontend, cache=None):
+    code = None
+
+    if cache:
+        data = cache.load()
+        if data is not None:
+            try:
+                code = marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                code = None
+
+    if code is None:
+        code = builtins.compile(transpile(ast), f'<pyscal {ast.id}>', 'exec')
+        if cache:
+            cache.store(marshal.dumps(code))
+
+    namespace = dict(RUNTIME)
+    exec(code, namespace)
+    return namespace['run'](frontend)
+
+
+class Expr(object):
+    """Python source of an expression.
+
+    `raw` expressions evaluate to the bare value of a ValueWrapper whose type
+    and real type are both `type`; the rest evaluate to a ValueWrapper.
+    A raw value is `exact` if it is already what the converter of its type
+    would make of it (comparisons give bools, `/` on ints gives floats).
+    """
+
+    def __init__(self, code, type, raw=True, exact=True):
+        self.code = code
+        self.type = type
+        self.raw = raw
+        self.exact = exact
+
+
+class Name(Symbol):
+    """A pyscal variable or function and the Python name it is emitted as."""
+
+    def __init__(self, id, py_id, type, level, params=None):
+        # `level` is the nesting depth of the def whose locals hold the name
+        super().__init__(id)
+        self.py_id = py_id
+        self.type = type
+        self.level = level
+        self.params = params
+        self.exact = type != 'real'  # real variables start out as int 0
+
+
+class Transpiler(ast.NodeVisitor):
+    """Emits a Python module equivalent to a pyscal program.
+
+    Functions become nested defs and blocks are flattened into the body
+    of the enclosing def, with every declaration renamed to a unique
+    Python identifier. Operations are emitted from the implementations the
+    analyzer picked: those specialized for concrete types are inlined on
+    unwrapped values, everything else goes through `operations` as usual.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+        self.ctx_names = {}
+        self.ctx_lines = []
+        self.source_lines = {}
+        self.scope = Scope()
+        self.counter = 0
+        self.level = 0
+        self.func = None
+        self.nonlocals = None
+
+    def transpile(self, node):
+        self.visit(node)
+
+        # contexts share a table of the source lines they point into
+        lines = [''] * (max(self.source_lines, default=0) + 1)
+        for line_no, line in self.source_lines.items():
+            lines[line_no] = line
+        return '\n'.join([f'_lines = {repr(lines)}'] + self.ctx_lines + self.lines) + '\n'
+
+    """Helpers"""
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def ctx(self, ctx):
+        if ctx is None:
+            return 'None'
+
+        name = self.ctx_names.get(id(ctx))
+        if name is None:
+            name = self.ctx_names[id(ctx)] = f'_c{len(self.ctx_names)}'
+            self.source_lines[ctx.line_no] = ctx.line
+            self.ctx_lines.append(f'{name} = Context(_lines, {ctx.line_no}, {ctx.pos})')
+        return name
+
+    def declare(self, id, prefix, type, params=None):
+        name = Name(id, f'{prefix}{self.counter}_{id}', type, self.level, params)
+        self.counter += 1
+        self.scope.insert(name)
+        return name
+
+    def store(self, name):
+        if name.level < self.level:
+            self.nonlocals.add(name.py_id)
+        return name.py_id
+
+    def wrap(self, expr):
+        if expr.raw:
+            return f'ValueWrapper({repr(expr.type)}, {expr.code})'
+        return expr.code
+
+    def truth(self, expr):
+        return expr.code if expr.raw else f'{expr.code}.value'
+
+    def converted(self, expr, convert):
+        """Value of raw `expr` passed through `convert`, one of operations.CONVERTERS."""
+        if expr.exact and operations.CONVERTERS[expr.type] is convert:
+            return expr.code
+        return f'{convert.__name__}({expr.code})'
+
+    def convert(self, expr, op, type, ctx, impl=None):
+        """Value of `expr` assigned to a variable of `type` with `op`.
+
+        `impl` is the analyzer's implementation of the assignment; values
+        it has no node for get the one operations picks for their types.
+        """
+        if expr.raw and type in CONCRETE_TYPES:
+            if impl is None:
+                impl = operations.get_assignment_impl(op, type, expr.type)
+            if impl.func is operations.assign_converted:
+                return self.converted(expr, impl.args[1])
+            if op == CAST_ASSIGN:
+                if expr.type == type:
+                    return self.converted(expr, operations.CONVERTERS[type])
+                return f'cast({expr.code}, {repr(type)}, {ctx})'
+
+        if expr.raw and type == 'any':
+            return f'ValueWrapper({repr(expr.type)}, {self.converted(expr, operations.CONVERTERS[expr.type])})'
+
+        code = f'get_assignment_value({repr(op)}, {repr(type)}, {self.wrap(expr)}, {ctx})'
+        return code + '.value' if type in CONCRETE_TYPES else code
+
+    def is_fallible(self, expr, type):
+        # raw values fit `any` as they are, other types need a specialized assignment
+        if not expr.raw:
+            return True
+        if type == 'any':
+            return False
+        return operations.get_assignment_impl(ASSIGN, type, expr.type).func is not operations.assign_converted
+
+    def body(self, node, create_scope=True):
+        start = len(self.lines)
+        self.indent += 1
+        self.visit_Block(node, create_scope)
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.indent -= 1
+
+    """Functions and blocks"""
+
+    def visit_Program(self, node):
+        params = [param.type and param.type.id or 'any' for param in node.params]
+        program = self.declare(node.id, 'f', 'int', params)
+        param_cnt = len(node.params)
+
+        self.emit('def run(frontend):')
+        self.indent += 1
+        self.emit('print_ = frontend.print')
+        self.emit('read = frontend.read')
+
+        self.func_def(node, program)
+
+        self.emit('args = frontend.get_args()')
+        self.emit(f'if len(args) != {param_cnt}:')
+        self.emit(f"    raise PyscalSemanticError(f'program {node.id} requires {param_cnt} argument(s), "
+                  f"but {{len(args)}} given', {self.ctx(node.token.ctx)})")
+
+        args = []
+        for i, (param, type) in enumerate(zip(node.params, program.params)):
+            arg = Expr(f'args[{i}]', 'string', raw=False)
+            args.append(self.convert(arg, CAST_ASSIGN, type, self.ctx(param.token.ctx)))
+        self.emit(f'return {program.py_id}({", ".join(args)})')
+
+    def visit_FuncDef(self, node):
+        ret_type = node.ret_type and node.ret_type.id or 'any'
+        params = [param.type and param.type.id or 'any' for param in node.params]
+        return self.declare(node.id, 'f', ret_type, params)
+
+    def func_def(self, node, func):
+        outer = self.func, self.nonlocals, self.scope
+        self.scope = Scope(self.scope)
+        self.func, self.nonlocals = func, set()
+        self.level += 1
+
+        params = [self.declare(param.var.id, 'v', type) for param, type in zip(node.params, func.params)]
+        for param in params:
+            param.exact = True
+
+        self.emit(f'def {func.py_id}({", ".join(param.py_id for param in params)}):')
+        header = len(self.lines)
+        self.indent += 1
+        self.visit_Block(node.body, create_scope=False)
+        self.emit(f'return {DEFAULT_RETURNS[func.type]}')
+
+        if self.nonlocals:
+            self.lines.insert(header, '    ' * self.indent + f'nonlocal {", ".join(sorted(self.nonlocals))}')
+
+        self.indent -= 1
+        self.level -= 1
+        self.func, self.nonlocals, self.scope = outer
+
+    def visit_Block(self, node, create_scope=True):
+        if create_scope:
+            self.scope = Scope(self.scope)
+
+        funcs = [self.visit(func_def) for func_def in node.functions]
+        for func_def, func in zip(node.functions, funcs):
+            self.func_def(func_def, func)
+
+        statements = node.statements
+        for i, stmt in enumerate(statements):
+            if isinstance(stmt, ast.VarDecl):
+                name = self.visit(stmt)
+                # a declaration followed by an initializer never exposes the default
+                init = statements[i + 1] if i + 1 < len(statements) else None
+                if isinstance(init, ast.Assignment) and init.left.id == name.id and not self.uses(init.right, name.id):
+                    name.exact = True
+            elif isinstance(stmt, ast.Block):
+                self.visit_Block(stmt)
+            else:
+                expr = self.visit(stmt)
+                if isinstance(stmt, ast.FuncCall):
+                    self.emit(expr.code)
+
+        if create_scope:
+            self.scope = self.scope.enclosing_scope
+
+    def uses(self, node, id):
+        if isinstance(node, ast.Var) and node.id == id:
+            return True
+        return any(self.uses(child, id) for child in node.get_children() if child)
+
+    """Expressions"""
+
+    def visit_UnaryOp(self, node):
+        expr = self.visit(node.expr)
+        type = node.value_type
+
+        if expr.raw and node.impl.func is operations.un_op_converted:
+            _, _, convert = node.impl.args
+            if node.op == CAST:
+                return Expr(f'ValueWrapper({repr(type)}, {expr.code}, {repr(expr.type)})', type, raw=False)
+            value = self.converted(expr, convert)
+            return Expr(f'(-{value})' if node.op == MINUS else value, type)
+
+        ctx = self.ctx(node.token.ctx)
+        return Expr(f'get_un_op_value({repr(node.op)}, {self.wrap(expr)}, {ctx})', type, raw=False)
+
+    def visit_BinaryOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        type = node.value_type
+        op = node.op
+
+        if not (left.raw and right.raw and node.impl.func is operations.bin_op_converted):
+            ctx = self.ctx(node.token.ctx)
+            code = f'get_bin_op_value({repr(op)}, {self.wrap(left)}, {self.wrap(right)}, {ctx})'
+            return Expr(code, type, raw=False)
+
+        _, _, convert1, convert2 = node.impl.args
+        left = self.converted(left, convert1)
+        right = self.converted(right, convert2)
+
+        if op in LOGIC_OPS:
+            return Expr(f'(bool({left}) {LOGIC_OPS[op]} bool({right}))', type, exact=False)
+        if op in COMPARISON_OPS:
+            return Expr(f'({left} {COMPARISON_OPS[op]} {right})', type, exact=False)
+        return Expr(f'({left} {ARITHMETIC_OPS[op]} {right})', type,
+                    exact=not (op == REAL_DIV and convert1 is int))
+
+    def visit_Assignment(self, node):
+        name = self.scope.lookup(node.left.id)
+        expr = self.visit(node.right)
+        value = self.convert(expr, node.op, name.type, self.ctx(node.token.ctx), node.impl)
+        self.emit(f'{self.store(name)} = {value}')
+
+    def visit_Var(self, node):
+        name = self.scope.lookup(node.id)
+        return Expr(name.py_id, name.type, raw=name.type in CONCRETE_TYPES, exact=name.exact)
+
+    def visit_Literal(self, node):
+        # the optimizer's literals can hold any value an operation gives
+        value, type, real_type = node.value, node.value_type, node.constant.real_type
+        if isinstance(value, float) and not math.isfinite(value):
+            code = f'float({repr(str(value))})'
+        else:
+            code = repr(value)
+
+        if type not in CONCRETE_TYPES or real_type != type:
+            return Expr(f'ValueWrapper({repr(type)}, {code}, {repr(real_type)})', type, raw=False)
+        return Expr(code, type, exact=value.__class__ is operations.CONVERTERS[type])
+
+    def visit_VarDecl(self, node):
+        type = node.type and node.type.id or 'any'
+        name = self.declare(node.var.id, 'v', type)
+        self.emit(f'{name.py_id} = {DEFAULT_VALUES[type]}')
+        return name
+
+    def visit_FuncCall(self, node):
+        func = self.scope.lookup(node.id)
+        args = [self.visit(arg) for arg in node.args]
+        ctxs = [self.ctx(arg.token.ctx) for arg in node.args]
+
+        # arguments are converted only after all of them are evaluated
+        if any(self.is_fallible(arg, type) for arg, type in zip(args[:-1], func.params)):
+            names = [f'a{i}' for i in range(len(args))]
+            converted = [self.convert(Expr(name, arg.type, arg.raw, arg.exact), ASSIGN, type, ctx)
+                         for name, arg, type, ctx in zip(names, args, func.params, ctxs)]
+            code = (f'(lambda {", ".join(names)}: {func.py_id}({", ".join(converted)}))'
+                    f'({", ".join(arg.code for arg in args)})')
+        else:
+            converted = [self.convert(arg, ASSIGN, type, ctx) for arg, type, ctx in zip(args, func.params, ctxs)]
+            code = f'{func.py_id}({", ".join(converted)})'
+
+        return Expr(code, func.type, raw=func.type in CONCRETE_TYPES)
+
+    """Statements"""
+
+    def visit_IfStmt(self, node):
+        keyword = 'if'
+        while node:
+            if node.expr is None:
+                self.emit('else:')
+            else:
+                self.emit(f'{keyword} {self.truth(self.visit(node.expr))}:')
+            self.body(node.body)
+            keyword = 'elif'
+            node = node.next
+
+    def visit_WhileStmt(self, node):
+        self.emit(f'while {self.truth(self.visit(node.expr))}:')
+        self.body(node.body)
+
+    def visit_SpecialStmt(self, node):
+        if node.type in (BREAK, CONTINUE):
+            self.emit(node.type.lower())
+
+        elif node.type == RETURN:
+            ret_type = self.func.type
+            if node.args:
+                expr = self.visit(node.args[0])
+                self.emit(f'return {self.convert(expr, ASSIGN, ret_type, self.ctx(node.token.ctx))}')
+            else:
+                self.emit(f'return {DEFAULT_RETURNS[ret_type]}')
+
+        elif node.type == PRINT:
+            for arg in node.args:
+                self.emit(f'print_({self.wrap(self.visit(arg))})')
+
+        elif node.type == READ:
+            for arg in node.args:
+                name = self.scope.lookup(arg.id)
+                value = self.convert(Expr('read()', 'string', raw=False), CAST_ASSIGN, name.type,
+                                     self.ctx(arg.token.ctx))
+                self.emit(f'{self.store(name)} = {value}')
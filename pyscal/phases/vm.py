@@ -0,0 +1,146 @@
+import sys
+
+from objects.errors import PyscalException, PyscalSemanticError
+from helpers import default_value
+from scope import outer_frame
+from objects.tokens import *
+from phases.bytecode import *
+import operations
+
+
+def interpret(ast, frontend):
+    return VM(frontend).run(compile(ast)).value
+
+
+class VM(object):
+    """Stack machine that executes CodeObjects.
+
+    Calls push a frame onto an explicit frame stack instead of recursing,
+    so the dispatch loop below is the only Python frame that runs pyscal code.
+    """
+
+    def __init__(self, frontend):
+        self.frontend = frontend
+
+    def run(self, program):
+        args = self.frontend.get_args()
+
+        param_cnt = len(program.params)
+        arg_cnt = len(args)
+        if param_cnt != arg_cnt:
+            raise PyscalSemanticError(f'program {program.id} requires {param_cnt} argument(s), but {arg_cnt} given',
+                                      program.body.ctx)
+
+        frame = self.bind_args(program, args, program.body.param_ctxs, None, op=CAST_ASSIGN)
+        return self.execute(program, frame)
+
+    def bind_args(self, func, args, arg_ctxs, static_link, op=ASSIGN):
+        frame = [None] * func.frame_size
+        frame[0] = static_link
+        for (slot, type), arg, ctx in zip(func.params, args, arg_ctxs):
+            frame[slot] = operations.get_assignment_value(op, type, arg, ctx=ctx)
+        return frame
+
+    def execute(self, func, frame):
+        get_assignment_value = operations.get_assignment_value
+        print_ = self.frontend.print
+        read = self.frontend.read
+        bind_args = self.bind_args
+        # calls do not use the Python stack, so its limit is applied here
+        max_depth = sys.getrecursionlimit()
+
+        frames = []
+        stack = []
+        body = func.body
+        code, consts = body.code, body.consts
+        pc = 0
+
+        try:
+            while True:
+                op = code[pc]
+                arg = code[pc + 1]
+                pc += 2
+
+                if op == LOAD_LOCAL:
+                    stack.append(frame[arg])
+                elif op == LOAD_CONST:
+                    stack.append(consts[arg])
+                elif op == BINARY_OP:
+                    right = stack.pop()
+                    stack[-1] = consts[arg](stack[-1], right)
+                elif op == POP_JUMP_IF_FALSE:
+                    if not stack.pop().value:
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == STORE_LOCAL:
+                    slot, impl = consts[arg]
+                    frame[slot] = impl(stack.pop())
+                elif op == LOAD_VAR:
+                    hops, slot = consts[arg]
+                    stack.append(outer_frame(frame, hops)[slot])
+                elif op == STORE_VAR:
+                    hops, slot, impl = consts[arg]
+                    outer_frame(frame, hops)[slot] = impl(stack.pop())
+                elif op == UNARY_OP:
+                    stack[-1] = consts[arg](stack[-1])
+                elif op == CALL_FUNCTION:
+                    callee, hops, arg_cnt, arg_ctxs = consts[arg]
+                    if arg_cnt:
+                        args = stack[-arg_cnt:]
+                        del stack[-arg_cnt:]
+                    else:
+                        args = []
+
+                    new_frame = bind_args(callee, args, arg_ctxs, outer_frame(frame, hops))
+
+                    if len(frames) >= max_depth:
+                        raise RecursionError('maximum recursion depth exceeded')
+                    frames.append((func, pc, frame, stack))
+                    func, pc, frame, stack = callee, 0, new_frame, []
+                    body = func.body
+                    code, consts = body.code, body.consts
+                elif op == TAIL_CALL:
+                    callee, hops, arg_cnt, arg_ctxs = consts[arg]
+                    if arg_cnt:
+                        args = stack[-arg_cnt:]
+                        del stack[-arg_cnt:]
+                    else:
+                        args = []
+
+                    frame = bind_args(callee, args, arg_ctxs, outer_frame(frame, hops))
+                    func, pc, stack = callee, 0, []
+                    body = func.body
+                    code, consts = body.code, body.consts
+                elif op == RETURN_VALUE or op == RETURN_NONE:
+                    value = stack.pop() if op == RETURN_VALUE else None
+                    if value is None:
+                        value = default_value(func.ret_type)
+                    value = get_assignment_value(ASSIGN, func.ret_type, value, ctx=body.ctxs[(pc >> 1) - 1])
+
+                    if not frames:
+                        return value
+
+                    func, pc, frame, stack = frames.pop()
+                    body = func.body
+                    code, consts = body.code, body.consts
+                    stack.append(value)
+                elif op == POP_TOP:
+                    stack.pop()
+                elif op == DECLARE_VAR:
+                    slot, value = consts[arg]
+                    frame[slot] = value
+                elif op == PRINT_VALUE:
+                    print_(stack.pop())
+                elif op == READ_VAR:
+                    hops, slot, type = consts[arg]
+                    outer_frame(frame, hops)[slot] = get_assignment_value(CAST_ASSIGN, type, read())
+                else:
+                    raise RuntimeError(f'unknown opcode {op}')
+
+        except PyscalException as e:
+            # operations are called without a context on the hot path,
+            # the failing instruction supplies it here
+            if e.ctx is None:
+                e.ctx = body.ctxs[(pc >> 1) - 1]
+            raise
@@ -0,0 +1,111 @@
+import json
+import sys
+import time
+
+from tracer import Tracer, function_name
+
+REPORT_LINES = 20  # hottest lines in the printed report, the file has all
+
+
+class LineProfile(object):
+    __slots__ = ('ctx', 'hits', 'time')
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.hits = 0
+        self.time = 0.0
+
+
+class FunctionProfile(object):
+    __slots__ = ('symbol', 'calls', 'inclusive', 'exclusive', 'active')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.active = 0  # running activations, see leave_func
+
+
+class Profiler(Tracer):
+    """Hits and time of every line, calls and time of every function.
+
+    The time between two events goes to the line that was running, so a
+    line is charged for its own statement and the lines of the functions
+    it calls for the rest.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lines = {}  # line number -> LineProfile
+        self.functions = {}  # id of a FuncSymbol -> FunctionProfile
+        self.stack = []  # [caller's line, FunctionProfile, start, time in callees] of running functions
+        self.line = None
+        self.last = None
+
+    def visit_line(self, ctx):
+        now = self.clock()
+        if self.line is not None:
+            self.line.time += now - self.last
+
+        line = self.lines.get(ctx.line_no)
+        if line is None:
+            line = self.lines[ctx.line_no] = LineProfile(ctx)
+        line.hits += 1
+        self.line = line
+        self.last = now
+
+    def enter_func(self, func):
+        now = self.clock()
+        if self.line is not None:
+            self.line.time += now - self.last
+
+        function = self.functions.get(id(func))
+        if function is None:
+            function = self.functions[id(func)] = FunctionProfile(func)
+        function.calls += 1
+        function.active += 1
+        self.stack.append([self.line, function, now, 0.0])
+        self.line = None
+        self.last = now
+
+    def leave_func(self):
+        now = self.clock()
+        if self.line is not None:
+            self.line.time += now - self.last
+
+        self.line, function, start, callees = self.stack.pop()
+        elapsed = now - start
+        function.exclusive += elapsed - callees
+        function.active -= 1
+        if not function.active:  # recursive calls are inside the outermost one
+            function.inclusive += elapsed
+        if self.stack:
+            self.stack[-1][3] += elapsed
+        self.last = now
+
+    def report(self, file=sys.stderr):
+        functions = sorted(self.functions.values(), key=lambda f: f.exclusive, reverse=True)
+        lines = sorted(self.lines.items(), key=lambda item: item[1].time, reverse=True)
+
+        print('=== PROFILE ===', file=file)
+        print(f'{"calls":>10} {"inclusive":>11} {"exclusive":>11}  function', file=file)
+        for function in functions:
+            print(f'{function.calls:>10} {function.inclusive:11.6f} {function.exclusive:11.6f}  '
+                  f'{function_name(function.symbol)}', file=file)
+        print(file=file)
+        print(f'{"hits":>10} {"time":>11}  line', file=file)
+        for line_no, line in lines[:REPORT_LINES]:
+            print(f'{line.hits:>10} {line.time:11.6f}  {line_no:<5} {line.ctx.line.strip()}', file=file)
+        print('===============', file=file)
+
+    def dump(self, file):
+        data = {
+            'functions': [{'name': function.symbol.id, 'line': function.symbol.ctx.line_no,
+                           'calls': function.calls, 'inclusive': function.inclusive,
+                           'exclusive': function.exclusive}
+                          for function in self.functions.values()],
+            'lines': [{'line': line_no, 'hits': line.hits, 'time': line.time}
+                      for line_no, line in sorted(self.lines.items())],
+        }
+        file.write(json.dumps(data, indent=1))
@@ -1,51 +1,116 @@
 #!/usr/bin/env python3
 
 import argparse
+import gc
 import sys
-import pickle
 
 from objects.errors import PyscalException
-from phases import interpreter, analyzer, parser, tokenizer
-from frontend import Frontend
+from phases import interpreter, compiler, vm, transpiler, optimizer, analyzer, parser, tokenizer
+from phases.incremental import IncrementalParser
+from cache import Cache, source_digest
+import serializer
+import operations
+import scope
+import helpers
+import objects.ast
+import objects.tokens
+from frontend import Frontend, Reload
+from stats import Stats
+from profiler import Profiler
+from tracer import TraceBuffer, DEFAULT_TRACE_SIZE
+
+# cached ASTs carry the results of analysis and optimization, and the
+# transpiled code depends on those too
+FRONT_END = (tokenizer, parser, analyzer, optimizer, operations, scope, helpers, objects.ast, objects.tokens,
+             serializer)
+AST_CACHE_TAG = f'ast-{serializer.VERSION}-{sys.implementation.cache_tag}-{source_digest(FRONT_END)}'
+TRANSPILED_CACHE_TAG = f'{transpiler.CACHE_TAG}-{source_digest(FRONT_END + (transpiler,))}'
+
+ENGINES = {
+    'tree': interpreter,
+    'closure': compiler,
+    'vm': vm,
+    'python': transpiler,
+}
 
 
 def main():
     args = parse_args()
     phase = 'preparation'
     tokens = ast = None
+    stats = Stats(enabled=args.stats)
+    if args.profile:
+        tracer = Profiler()
+    elif args.trace:
+        tracer = TraceBuffer(args.trace_size)
+    else:
+        tracer = None
 
     need_analyze = args.analyze or args.save_ast or args.interpret and not args.load_ast
     need_parse = args.parse or need_analyze and not args.load_ast
     need_tokenize = args.tokenize or need_parse and not args.load_ast
 
+    # the front end is skipped if an earlier run left its result in the
+    # cache, unless its phases were asked for explicitly; the debugger
+    # parses incrementally instead, so that `reload` only parses the edits
+    ast_cache = None
+    use_ast_cache = need_analyze and not (args.tokenize or args.parse or args.analyze or args.debug or args.no_cache)
+    incremental_parser = IncrementalParser() if args.debug else None
+
+    # the front end only builds objects that live until the program ends,
+    # looking for garbage among them is wasted time
+    gc.disable()
+
     try:
-        if need_tokenize:
-            file = open(args.input_file, 'r')
+        if use_ast_cache:
+            stats.enter('cache lookup')
+            ast_cache = Cache(args.input_file, 'opt.ast' if args.optimize else 'ast', AST_CACHE_TAG)
+            ast = load_cached_ast(ast_cache)
+            if ast is not None:
+                need_tokenize = need_parse = need_analyze = False
+                ast_cache = None
 
-            phase = 'lexical analysis'
+        if need_tokenize and incremental_parser and not (args.tokenize or args.parse):
+            phase = 'syntactic analysis'
+            stats.enter(phase)
+            ast = parse_incrementally(incremental_parser, args.input_file)
+
+        elif need_tokenize:
+            file = open(args.input_file, 'r')
 
             with file:
-                tokens = [x for x in tokenizer.tokenize(file)]  # buffer the iter
+                phase = 'lexical analysis'
+                tokens = tokenizer.tokenize(file)
 
-            if args.tokenize:
-                print('=== TOKENS ===')
-                for x in tokens:
-                    print(x)
-                print('==============')
-                print()
+                if args.tokenize:
+                    stats.enter(phase)
+                    tokens = [x for x in tokens]  # buffer the iter
 
-        if need_parse:
-            phase = 'syntactic analysis'
-            ast = parser.parse(iter(tokens))
+                    print('=== TOKENS ===')
+                    for x in tokens:
+                        print(x)
+                    print('==============')
+                    print()
 
-            if args.parse:
-                print('=== AST ===')
-                print(ast.pretty_print())
-                print('===========')
-                print()
+                    tokens = iter(tokens)
+                else:
+                    # the parser pulls tokens straight from the file
+                    tokens = in_phase(tokens, phase)
+
+                if need_parse:
+                    phase = 'syntactic analysis'
+                    stats.enter(phase)
+                    ast = parser.parse(tokens)
+
+                    if args.parse:
+                        print('=== AST ===')
+                        print(ast.pretty_print())
+                        print('===========')
+                        print()
 
         if need_analyze:
             phase = 'semantic analysis'
+            stats.enter(phase)
             analyzer.analyze(ast)
 
             if args.analyze:
@@ -57,26 +122,124 @@ def main():
         if args.load_ast:
             file = open(args.input_file, 'rb')
             with file:
-                ast = pickle.load(file)
+                ast = serializer.loads(file.read())
+
+        if args.optimize and (need_analyze or args.load_ast):
+            phase = 'optimization'
+            stats.enter(phase)
+            optimizer.optimize(ast)
+
+        if ast_cache:
+            store_cached_ast(ast_cache, ast)
 
         if args.save_ast:
             file = open(args.save_ast, 'wb')
             with file:
-                pickle.dump(ast, file)
+                file.write(serializer.dumps(ast))
 
         if args.interpret:
             phase = 'runtime'
+            stats.enter(phase)
+            gc.freeze()
+            gc.enable()
             print('=== BEGIN INTERPRETATION ===')
             frontend = Frontend(args.program_args, debug_mode=args.debug)
-            exit_code = interpreter.interpret(ast, frontend)
+            if args.engine == 'python':
+                cache = None if args.no_cache else Cache(args.input_file,
+                                                         'opt.transpiled.pyc' if args.optimize else 'transpiled.pyc',
+                                                         TRANSPILED_CACHE_TAG)
+                exit_code = transpiler.interpret(ast, frontend, cache=cache)
+            elif args.debug:
+                exit_code = debug(ast, frontend, incremental_parser, args)
+            elif args.engine == 'tree':
+                exit_code = interpreter.interpret(ast, frontend, memo_size=args.memo_size, tracer=tracer)
+            elif args.engine == 'closure':
+                exit_code = compiler.interpret(ast, frontend, memo_size=args.memo_size)
+            else:
+                exit_code = ENGINES[args.engine].interpret(ast, frontend)
             sys.exit(exit_code)
 
     except PyscalException as e:
-        print_error(phase, e)
+        print_error(getattr(e, 'phase', phase), e)
     except RecursionError as e:
         print_error(phase, e)
     except OSError as e:
         print_error(phase, e)
+    finally:
+        stats.report()
+        if args.profile:
+            tracer.report()
+        write_trace(tracer, args.profile_output or args.trace)
+
+
+def debug(ast, frontend, incremental_parser, args):
+    # `reload` runs the program again from its edited file, keeping the
+    # breakpoints; an optimized tree can not be reused, see IncrementalParser
+    while True:
+        try:
+            return interpreter.interpret(ast, frontend, memo_size=args.memo_size)
+        except Reload:
+            pass
+
+        # a saved tree has no source to parse again, it runs as it is
+        if not args.load_ast:
+            try:
+                if args.optimize:
+                    incremental_parser = IncrementalParser()
+                ast = parse_incrementally(incremental_parser, args.input_file)
+                analyzer.analyze(ast)
+                if args.optimize:
+                    optimizer.optimize(ast)
+            except PyscalException as e:
+                e.phase = 'reloading'
+                raise
+
+        print('=== RELOADED ===')
+        frontend.reload()
+
+
+def parse_incrementally(incremental_parser, input_file):
+    file = open(input_file, 'r')
+    with file:
+        return incremental_parser.parse(file)
+
+
+def in_phase(tokens, phase):
+    # errors of a stream consumed by a later phase still belong to this one
+    try:
+        yield from tokens
+    except PyscalException as e:
+        e.phase = phase
+        raise
+
+
+def load_cached_ast(cache):
+    data = cache.load()
+    if data is None:
+        return None
+
+    try:
+        return serializer.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def store_cached_ast(cache, ast):
+    try:
+        data = serializer.dumps(ast)
+    except RecursionError:
+        return  # caching is best-effort
+    cache.store(data)
+
+
+def write_trace(tracer, output_file):
+    if not output_file:
+        return
+    try:
+        with open(output_file, 'w') as file:
+            tracer.dump(file)
+    except OSError as e:
+        print_error('tracing', e)
 
 
 def print_error(phase, message):
@@ -95,6 +258,21 @@ def parse_args():
     arg_parser.add_argument('-s', '--save-ast', metavar='output_file')
     arg_parser.add_argument('-l', '--load-ast', action='store_true')
     arg_parser.add_argument('-d', '--debug', action='store_true')
+    arg_parser.add_argument('-O', '--optimize', action='store_true')
+    arg_parser.add_argument('-e', '--engine', choices=ENGINES.keys(), default='tree')
+    arg_parser.add_argument('--no-cache', action='store_true', help='do not read or write cached programs')
+    arg_parser.add_argument('--stats', action='store_true', help='report time and peak memory of each phase')
+    arg_parser.add_argument('--memo-size', type=int, default=interpreter.DEFAULT_MEMO_SIZE, metavar='N',
+                            help='results of pure functions to cache per function, 0 disables caching')
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='report hits and time of each line and calls and time of each function')
+    arg_parser.add_argument('--profile-output', metavar='output_file',
+                            help='also write the profile to output_file as JSON, implies --profile')
+    arg_parser.add_argument('--trace', metavar='output_file',
+                            help='write the last calls, lines and I/O of the program to output_file '
+                                 'in Chrome\'s trace event format')
+    arg_parser.add_argument('--trace-size', type=int, default=DEFAULT_TRACE_SIZE, metavar='N',
+                            help='events kept by --trace')
 
     arg_parser.add_argument('input_file')
     arg_parser.add_argument('program_args', nargs=argparse.REMAINDER)
@@ -103,6 +281,24 @@ def parse_args():
 
     if args.debug:
         args.interpret = True
+        if args.engine != 'tree':
+            arg_parser.error('option -d is only supported by the tree engine')
+
+    if args.profile_output:
+        args.profile = True
+    for option, enabled in (('--profile', args.profile), ('--trace', args.trace)):
+        if not enabled:
+            continue
+        if args.engine != 'tree':
+            arg_parser.error(f'option {option} is only supported by the tree engine')
+        if args.debug:
+            arg_parser.error(f'options -d and {option} are not compatible')
+    if args.profile and args.trace:
+        arg_parser.error('options --profile and --trace are not compatible')
+    if args.memo_size < 0:
+        arg_parser.error('option --memo-size must not be negative')
+    if args.trace_size < 1:
+        arg_parser.error('option --trace-size must be positive')
 
     if args.tokenize or args.parse or args.analyze or args.save_ast:
         if args.load_ast:
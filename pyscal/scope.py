@@ -1,10 +1,29 @@
 from helpers import ValueWrapper
 
 
+def outer_frame(frame, hops):
+    # slot 0 of every frame holds the frame of the lexically enclosing function
+    while hops:
+        frame = frame[0]
+        hops -= 1
+    return frame
+
+
 class Scope(object):
-    def __init__(self, enclosing_scope=None, is_loop=None, ret_type=None):
+    def __init__(self, enclosing_scope=None, is_loop=None, ret_type=None, is_function=False):
         self.symbols = {}
         self.enclosing_scope = enclosing_scope
+        self.frame_size = 1  # slot 0 is the static link
+
+        if enclosing_scope is None:
+            self.depth = 0
+            self.function_scope = self
+        elif is_function:
+            self.depth = enclosing_scope.depth + 1
+            self.function_scope = self
+        else:
+            self.depth = enclosing_scope.depth
+            self.function_scope = enclosing_scope.function_scope
 
         if is_loop is not None:
             self.inside_loop = is_loop
@@ -33,19 +52,28 @@ class Scope(object):
     def insert(self, symbol):
         self.symbols[symbol.id] = symbol
 
+    def allocate_slot(self):
+        # all blocks of a function share its frame
+        function_scope = self.function_scope
+        slot = function_scope.frame_size
+        function_scope.frame_size += 1
+        return slot
+
     def lookup(self, id, current_scope_only=False):
         # 'symbol' is either an instance of the Symbol class or None
         symbol = self.symbols.get(id)
 
-        if symbol is not None:
+        if symbol is not None or current_scope_only:
             return symbol
 
-        if current_scope_only:
-            return None
-
-        # recursively go up the chain and lookup the name
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(id)
+        # go up the chain and lookup the name
+        scope = self.enclosing_scope
+        while scope is not None:
+            symbol = scope.symbols.get(id)
+            if symbol is not None:
+                return symbol
+            scope = scope.enclosing_scope
+        return None
 
 
 class Symbol(object):
@@ -66,20 +94,36 @@ TypeSymbol.VOID = TypeSymbol('void')
 
 
 class VarSymbol(Symbol):
-    def __init__(self, id, decl_type):
+    def __init__(self, id, decl_type, depth=0, slot=None):
         super().__init__(id)
         self.decl_type = decl_type
-
-        type = 'int' if decl_type == 'any' else decl_type
-        self.value = ValueWrapper(type)
+        self.depth = depth
+        self.slot = slot
 
 
 class FuncSymbol(Symbol):
-    def __init__(self, id, ret_type, params, body):
+    def __init__(self, id, ret_type, params, body, depth=0, ctx=None):
         super().__init__(id)
         self.ret_type = ret_type
         self.params = params
         self.body = body
+        self.depth = depth  # depth of the function's own scope
+        self.ctx = ctx  # of the function's name in its definition
+        self.frame_size = None
 
     def src(self):
         return 'Not implemented yet'
+
+
+class FrameScope(object):
+    """A static scope bound to the frame it is running in."""
+
+    def __init__(self, scope, frame):
+        self.scope = scope
+        self.frame = frame
+
+    def lookup(self, id):
+        symbol = self.scope.lookup(id)
+        if not isinstance(symbol, VarSymbol):
+            return None
+        return outer_frame(self.frame, self.scope.depth - symbol.depth)[symbol.slot]
@@ -0,0 +1,533 @@
+import gc
+import marshal
+import struct
+import sys
+
+from helpers import ValueWrapper, constant_value
+from scope import Scope, TypeSymbol, VarSymbol, FuncSymbol
+from objects.tokens import *
+import objects.ast as ast
+import operations
+
+# Binary format of analyzed programs.
+#
+# The header is followed by a marshalled tuple of
+#   - the string table: identifiers, type and operator names, string values;
+#   - the line table: source line of every line number;
+#   - the symbol table and the scope table;
+#   - the operation table: operator, types and implementation kind of
+#     every distinct operation;
+#   - the chunks: one per function body, plus one holding the program node.
+#
+# A chunk is a marshalled tuple of node records in post-order, so children
+# come before their parents and are referred to by their index in the
+# chunk. Every record starts with the node kind and the line number and
+# column of its token. Strings, symbols and scopes are indices into their
+# tables, NONE marks a missing node or attribute.
+#
+# Function bodies stay encoded until their Block is first used.
+
+VERSION = 1
+MAGIC = b'PYSCAST'
+HEADER = struct.Struct(f'<{len(MAGIC)}sH')
+
+NONE = -1
+
+# node kinds
+PROGRAM = 0
+FUNC_DEF = 1
+BLOCK = 2
+UNARY_OP = 3
+BINARY_OP = 4
+ASSIGNMENT = 5
+VAR = 6
+TYPE = 7
+LITERAL = 8
+VAR_DECL = 9
+FUNC_CALL = 10
+IF_STMT = 11
+WHILE_STMT = 12
+SPECIAL_STMT = 13
+
+# symbol kinds
+TYPE_SYMBOL = 0
+VAR_SYMBOL = 1
+FUNC_SYMBOL = 2
+
+BUILTIN_TYPES = {symbol.id: symbol for symbol in (
+    TypeSymbol.INT, TypeSymbol.REAL, TypeSymbol.STRING, TypeSymbol.ANY, TypeSymbol.VOID,
+)}
+
+
+def dumps(program):
+    return Encoder().encode(program)
+
+
+def loads(data):
+    return Decoder(data).decode()
+
+
+class Encoder(ast.IterativeVisitor):
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.lines = {}
+        self.symbols = []
+        self.symbol_ids = {}
+        self.scopes = []
+        self.scope_ids = {}
+        self.operations = []
+        self.operation_ids = {}
+        self.chunks = []
+
+        # chunk being encoded
+        self.records = None
+        self.node_ids = None
+
+    def encode(self, program):
+        self.run(self.encode_chunk(program))
+
+        symbols = []
+        for symbol in self.symbols:  # grows while encoding callees
+            symbols.append(self.encode_symbol(symbol))
+        scopes = [self.encode_scope(scope) for scope in self.scopes]
+
+        lines = [''] * (max(self.lines, default=0) + 1)
+        for line_no, line in self.lines.items():
+            lines[line_no] = line
+
+        data = (tuple(self.strings), tuple(lines), tuple(symbols), tuple(scopes), tuple(self.operations),
+                tuple(self.chunks))
+        return HEADER.pack(MAGIC, VERSION) + marshal.dumps(data)
+
+    def encode_chunk(self, root):
+        index = len(self.chunks)
+        self.chunks.append(None)
+
+        outer = self.records, self.node_ids
+        self.records, self.node_ids = [], {}
+        yield root
+        self.chunks[index] = marshal.dumps(tuple(self.records))
+        self.records, self.node_ids = outer
+        return index
+
+    """Tables"""
+
+    def string(self, string):
+        index = self.string_ids.get(string)
+        if index is None:
+            index = self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def symbol(self, symbol):
+        index = self.symbol_ids.get(id(symbol))
+        if index is None:
+            index = self.symbol_ids[id(symbol)] = len(self.symbols)
+            self.symbols.append(symbol)
+        return index
+
+    def scope(self, scope):
+        if scope is None:
+            return NONE
+
+        index = self.scope_ids.get(id(scope))
+        if index is not None:
+            return index
+
+        # the scope and the enclosing ones not seen yet, then their symbols
+        # from the outside in
+        new_scopes = []
+        while scope is not None and id(scope) not in self.scope_ids:
+            self.scope_ids[id(scope)] = len(self.scopes)
+            self.scopes.append(scope)
+            new_scopes.append(scope)
+            scope = scope.enclosing_scope
+        for scope in reversed(new_scopes):
+            for symbol in scope.symbols.values():
+                self.symbol(symbol)
+        return self.scope_ids[id(new_scopes[0])]
+
+    def operation(self, kind, node):
+        value_type = getattr(node, 'value_type', None)
+        operation = (kind, self.string(node.op), self.string(node.type), tuple(map(self.string, node.arg_types)),
+                     NONE if value_type is None else self.string(value_type))
+        index = self.operation_ids.get(operation)
+        if index is None:
+            index = self.operation_ids[operation] = len(self.operations)
+            self.operations.append(operation)
+        return index
+
+    def encode_symbol(self, symbol):
+        if isinstance(symbol, TypeSymbol):
+            return TYPE_SYMBOL, self.string(symbol.id)
+        if isinstance(symbol, VarSymbol):
+            return VAR_SYMBOL, self.string(symbol.id), self.string(symbol.decl_type), symbol.depth, symbol.slot
+        callees = tuple(self.symbol(callee) for callee in symbol.callees)
+        return (FUNC_SYMBOL, self.string(symbol.id), self.string(symbol.ret_type), symbol.depth,
+                symbol.frame_size, symbol.pure, callees)
+
+    def encode_scope(self, scope):
+        return (self.scope(scope.enclosing_scope), self.scope(scope.function_scope), scope.depth,
+                scope.frame_size, scope.inside_loop, self.string(scope.ret_type),
+                tuple(self.symbol(symbol) for symbol in scope.symbols.values()))
+
+    """Nodes"""
+
+    def run(self, task):
+        return ast.run(task, self.node)
+
+    def node(self, node):
+        # index of the record of node, whose children are yielded to run
+        # and come back as indices
+        if node is None:
+            return NONE
+
+        # nodes can be shared, like the variable of a declaration and its
+        # initializer
+        index = self.node_ids.get(id(node))
+        if index is None:
+            return ast.NodeVisitor.visit(self, node)
+        return index
+
+    def nodes(self, nodes):
+        indices = []
+        for node in nodes:
+            indices.append((yield node))
+        return tuple(indices)
+
+    def add(self, node, record):
+        index = self.node_ids[id(node)] = len(self.records)
+        self.records.append(record)
+        return index
+
+    def position(self, node):
+        ctx = node.token.ctx
+        self.lines[ctx.line_no] = ctx.line
+        return ctx.line_no, ctx.pos
+
+    def optional_symbol(self, node):
+        symbol = getattr(node, 'symbol', None)
+        return NONE if symbol is None else self.symbol(symbol)
+
+    def visit_Program(self, node):
+        return (yield from self.visit_FuncDef(node, kind=PROGRAM))
+
+    def visit_FuncDef(self, node, kind=FUNC_DEF):
+        ret_type = yield node.ret_type
+        params = yield from self.nodes(node.params)
+        body = yield from self.encode_chunk(node.body)
+        return self.add(node, (kind, *self.position(node), self.string(node.id), ret_type, params,
+                               self.symbol(node.symbol), body))
+
+    def visit_Block(self, node):
+        functions = yield from self.nodes(node.functions)
+        statements = yield from self.nodes(node.statements)
+        return self.add(node, (BLOCK, *self.position(node), functions, statements, self.scope(node.scope)))
+
+    def visit_UnaryOp(self, node):
+        expr = yield node.expr
+        return self.add(node, (UNARY_OP, *self.position(node), self.operation(UNARY_OP, node), expr))
+
+    def visit_BinaryOp(self, node):
+        left = yield node.left
+        right = yield node.right
+        return self.add(node, (BINARY_OP, *self.position(node), self.operation(BINARY_OP, node), left, right))
+
+    def visit_Assignment(self, node):
+        left = yield node.left
+        right = yield node.right
+        return self.add(node, (ASSIGNMENT, *self.position(node), self.operation(ASSIGNMENT, node), left, right))
+
+    def visit_Var(self, node):
+        # the variable of a declaration is not analyzed on its own
+        return self.add(node, (VAR, *self.position(node), self.string(node.id), self.optional_symbol(node),
+                               getattr(node, 'hops', NONE)))
+
+    def visit_Type(self, node):
+        return self.add(node, (TYPE, *self.position(node), self.string(node.id)))
+
+    def visit_Literal(self, node):
+        value = node.value
+        is_string = value.__class__ is str
+        if is_string:
+            value = self.string(value)
+        return self.add(node, (LITERAL, *self.position(node), self.string(node.value_type), value, is_string,
+                               self.string(node.constant.real_type)))
+
+    def visit_VarDecl(self, node):
+        var = yield node.var
+        type = yield node.type
+        return self.add(node, (VAR_DECL, *self.position(node), var, type, self.optional_symbol(node)))
+
+    def visit_FuncCall(self, node):
+        args = yield from self.nodes(node.args)
+        return self.add(node, (FUNC_CALL, *self.position(node), self.string(node.id), args,
+                               self.symbol(node.symbol), node.hops))
+
+    def visit_IfStmt(self, node):
+        expr = yield node.expr
+        body = yield node.body
+        next = yield node.next
+        return self.add(node, (IF_STMT, *self.position(node), self.string(node.token.type), expr, body, next))
+
+    def visit_WhileStmt(self, node):
+        expr = yield node.expr
+        body = yield node.body
+        return self.add(node, (WHILE_STMT, *self.position(node), expr, body))
+
+    def visit_SpecialStmt(self, node):
+        args = yield from self.nodes(node.args)
+        tail_call = getattr(node, 'tail_call', NONE)
+        return self.add(node, (SPECIAL_STMT, *self.position(node), self.string(node.type), args, tail_call))
+
+
+class Decoder(object):
+    def __init__(self, data):
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a pyscal AST')
+        if version != VERSION:
+            raise ValueError(f'unsupported pyscal AST version {version}')
+
+        (self.strings, self.lines, self.symbol_records, self.scope_records, self.operation_records,
+         self.chunks) = marshal.loads(data[HEADER.size:])
+        self.symbols = []
+        self.scopes = []
+        self.operations = []
+
+        # chunk being decoded
+        self.nodes = None
+
+        self.decoders = {
+            PROGRAM: self.decode_FuncDef,
+            FUNC_DEF: self.decode_FuncDef,
+            BLOCK: self.decode_Block,
+            UNARY_OP: self.decode_UnaryOp,
+            BINARY_OP: self.decode_BinaryOp,
+            ASSIGNMENT: self.decode_Assignment,
+            VAR: self.decode_Var,
+            TYPE: self.decode_Type,
+            LITERAL: self.decode_Literal,
+            VAR_DECL: self.decode_VarDecl,
+            FUNC_CALL: self.decode_FuncCall,
+            IF_STMT: self.decode_IfStmt,
+            WHILE_STMT: self.decode_WhileStmt,
+            SPECIAL_STMT: self.decode_SpecialStmt,
+        }
+
+    def decode(self):
+        self.decode_symbols()
+        self.decode_scopes()
+        self.decode_operations()
+        return self.decode_chunk(0)
+
+    def decode_chunk(self, index, block=None):
+        # `block` is the node the root Block record is decoded into
+        records = marshal.loads(self.chunks[index])
+
+        # bodies may be decoded while the program runs; the nodes hold no
+        # garbage, so collections are held off meanwhile. They are not
+        # frozen: that would freeze the program's objects too.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            outer, self.nodes = self.nodes, []
+            for record in records[:-1]:
+                self.nodes.append(self.decoders[record[0]](record))
+            root = records[-1]
+            if block is None:
+                node = self.decoders[root[0]](root)
+            else:
+                node = self.decode_Block(root, block)
+            self.nodes = outer
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return node
+
+    def load_body(self, index):
+        def load(block):
+            self.decode_chunk(index, block)
+        return load
+
+    """Tables"""
+
+    def decode_symbols(self):
+        strings = self.strings
+        for record in self.symbol_records:
+            kind = record[0]
+            if kind == TYPE_SYMBOL:
+                symbol = BUILTIN_TYPES[strings[record[1]]]
+            elif kind == VAR_SYMBOL:
+                _, id, decl_type, depth, slot = record
+                symbol = VarSymbol(strings[id], strings[decl_type], depth, slot)
+            else:
+                _, id, ret_type, depth, frame_size, pure, callees = record
+                # parameters and body are set by the function's definition
+                symbol = FuncSymbol(strings[id], strings[ret_type], None, None, depth)
+                symbol.frame_size = frame_size
+                symbol.pure = pure
+            self.symbols.append(symbol)
+
+        for symbol, record in zip(self.symbols, self.symbol_records):
+            if record[0] == FUNC_SYMBOL:
+                symbol.callees = {self.symbols[callee] for callee in record[-1]}
+
+    def decode_scopes(self):
+        for _ in self.scope_records:
+            self.scopes.append(Scope.__new__(Scope))
+
+        for scope, record in zip(self.scopes, self.scope_records):
+            enclosing_scope, function_scope, depth, frame_size, inside_loop, ret_type, symbols = record
+            scope.enclosing_scope = self.scopes[enclosing_scope] if enclosing_scope != NONE else None
+            scope.function_scope = self.scopes[function_scope]
+            scope.depth = depth
+            scope.frame_size = frame_size
+            scope.inside_loop = inside_loop
+            scope.ret_type = self.strings[ret_type]
+            scope.symbols = {}
+            for symbol in symbols:
+                scope.insert(self.symbols[symbol])
+
+    def decode_operations(self):
+        get_impl = {
+            UNARY_OP: operations.get_un_op_impl,
+            BINARY_OP: operations.get_bin_op_impl,
+            ASSIGNMENT: operations.get_assignment_impl,
+        }
+        strings = self.strings
+        for kind, op, type, arg_types, value_type in self.operation_records:
+            op = sys.intern(strings[op])
+            arg_types = tuple(strings[arg_type] for arg_type in arg_types)
+            value_type = None if value_type == NONE else strings[value_type]
+            self.operations.append((op, strings[type], arg_types, value_type, get_impl[kind](op, *arg_types)))
+
+    """Nodes"""
+
+    def node(self, index):
+        return None if index == NONE else self.nodes[index]
+
+    def ctx(self, line_no, pos):
+        return Context(self.lines, line_no, pos)
+
+    def token(self, type, line_no, pos):
+        token = Token(type)
+        token.ctx = self.ctx(line_no, pos)
+        return token
+
+    def id_token(self, id, line_no, pos):
+        token = IDToken(self.strings[id])
+        token.ctx = self.ctx(line_no, pos)
+        return token
+
+    def decode_FuncDef(self, record):
+        kind, line_no, pos, id, ret_type, params, symbol, body = record
+        node_class = ast.Program if kind == PROGRAM else ast.FuncDef
+        params = [self.nodes[param] for param in params]
+
+        block = ast.Block.__new__(ast.Block)
+        block.load = self.load_body(body)
+
+        node = node_class(self.id_token(id, line_no, pos), self.node(ret_type), params, block)
+        node.symbol = self.symbols[symbol]
+        node.symbol.params = params
+        node.symbol.body = block
+        node.symbol.ctx = node.token.ctx
+        return node
+
+    def decode_Block(self, record, node=None):
+        _, line_no, pos, functions, statements, scope = record
+        if node is None:
+            node = ast.Block.__new__(ast.Block)
+        ast.Block.__init__(node, self.token(INDENT, line_no, pos))
+        node.functions = [self.nodes[function] for function in functions]
+        node.statements = [self.nodes[stmt] for stmt in statements]
+        node.scope = self.scopes[scope]
+        return node
+
+    def decode_UnaryOp(self, record):
+        _, line_no, pos, operation, expr = record
+        op, node_type, arg_types, value_type, impl = self.operations[operation]
+        node = ast.UnaryOp(self.token(op, line_no, pos), self.nodes[expr])
+        node.type, node.arg_types, node.value_type, node.impl = node_type, arg_types, value_type, impl
+        return node
+
+    def decode_BinaryOp(self, record):
+        _, line_no, pos, operation, left, right = record
+        op, node_type, arg_types, value_type, impl = self.operations[operation]
+        node = ast.BinaryOp(self.nodes[left], self.token(op, line_no, pos), self.nodes[right])
+        node.type, node.arg_types, node.value_type, node.impl = node_type, arg_types, value_type, impl
+        return node
+
+    def decode_Assignment(self, record):
+        _, line_no, pos, operation, left, right = record
+        op, node_type, arg_types, _, impl = self.operations[operation]
+        node = ast.Assignment(self.nodes[left], self.token(op, line_no, pos), self.nodes[right])
+        node.type, node.arg_types, node.impl = node_type, arg_types, impl
+        return node
+
+    def decode_Var(self, record):
+        _, line_no, pos, id, symbol, hops = record
+        node = ast.Var(self.id_token(id, line_no, pos))
+        if symbol != NONE:
+            node.symbol = symbol = self.symbols[symbol]
+            node.hops = hops
+            node.slot = symbol.slot
+            node.decl_type = symbol.decl_type
+        return node
+
+    def decode_Type(self, record):
+        _, line_no, pos, id = record
+        return ast.Type(self.id_token(id, line_no, pos))
+
+    def decode_Literal(self, record):
+        _, line_no, pos, value_type, value, is_string, real_type = record
+        value_type = self.strings[value_type]
+        real_type = self.strings[real_type]
+        if is_string:
+            value = self.strings[value]
+
+        token = LiteralToken(value_type, value)
+        token.ctx = self.ctx(line_no, pos)
+        node = ast.Literal(token)
+        if real_type == value_type:
+            node.constant = constant_value(value_type, value)
+        else:
+            node.constant = ValueWrapper(value_type, value, real_type)
+        return node
+
+    def decode_VarDecl(self, record):
+        _, line_no, pos, var, type, symbol = record
+        node = ast.VarDecl(self.nodes[var])
+        node.type = self.node(type)
+        if symbol != NONE:
+            node.symbol = symbol = self.symbols[symbol]
+            node.slot = symbol.slot
+            node.decl_type = symbol.decl_type
+        return node
+
+    def decode_FuncCall(self, record):
+        _, line_no, pos, id, args, symbol, hops = record
+        node = ast.FuncCall(self.id_token(id, line_no, pos), [self.nodes[arg] for arg in args])
+        node.symbol = self.symbols[symbol]
+        node.hops = hops
+        return node
+
+    def decode_IfStmt(self, record):
+        _, line_no, pos, type, expr, body, next = record
+        node = ast.IfStmt(self.token(sys.intern(self.strings[type]), line_no, pos), self.node(expr), self.nodes[body])
+        node.next = self.node(next)
+        return node
+
+    def decode_WhileStmt(self, record):
+        _, line_no, pos, expr, body = record
+        return ast.WhileStmt(self.token(WHILE, line_no, pos), self.nodes[expr], self.nodes[body])
+
+    def decode_SpecialStmt(self, record):
+        _, line_no, pos, type, args, tail_call = record
+        node = ast.SpecialStmt(self.token(sys.intern(self.strings[type]), line_no, pos))
+        node.args = [self.nodes[arg] for arg in args]
+        if tail_call != NONE:
+            node.tail_call = tail_call
+        return node
@@ -0,0 +1,57 @@
+import sys
+import time
+import tracemalloc
+
+
+class Stats(object):
+    """Wall time and peak memory use of each phase.
+
+    Memory is measured with tracemalloc, which slows everything down, so
+    a disabled instance measures nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = []
+        self.phase = None
+        self.start = None
+
+        if enabled:
+            tracemalloc.start()
+
+    def enter(self, phase):
+        if not self.enabled:
+            return
+
+        self.leave()
+        self.phase = phase
+        self.start = time.perf_counter()
+        tracemalloc.reset_peak()
+
+    def leave(self):
+        if self.phase is None:
+            return
+
+        elapsed = time.perf_counter() - self.start
+        current, peak = tracemalloc.get_traced_memory()
+        self.phases.append((self.phase, elapsed, current, peak))
+        self.phase = None
+
+    def report(self, file=sys.stderr):
+        if not self.enabled:
+            return
+
+        self.leave()
+        print('=== STATS ===', file=file)
+        for phase, elapsed, current, peak in self.phases:
+            print(f'{phase:<20} {elapsed:9.4f} s  peak {format_size(peak):>10}  after {format_size(current):>10}',
+                  file=file)
+        print('=============', file=file)
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
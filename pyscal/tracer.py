@@ -0,0 +1,142 @@
+import json
+import time
+from array import array
+
+DEFAULT_TRACE_SIZE = 1 << 20  # events kept by a TraceBuffer
+
+# event kinds
+CALL = 1
+RETURN = 2
+LINE = 3
+IO = 4
+IO_END = 5
+
+
+def function_name(symbol):
+    # functions of the same name are told apart by the line they are defined on
+    return f'{symbol.id}:{symbol.ctx.line_no}'
+
+
+def line_start(ctx):
+    # column of the first statement on the line of ctx
+    line = ctx.line
+    return len(line) - len(line.lstrip(' ')) + 1
+
+
+class Tracer(object):
+    """Receives the events of a program run by TracingInterpreter.
+
+    Every method does nothing, subclasses override the events they need.
+    Lines are given by the Context of their statement's main token, which
+    is not always its first one (the operator of an assignment), so only
+    their line number is reliable. Functions are given by their
+    FuncSymbol.
+    """
+
+    def visit_line(self, ctx):
+        pass
+
+    def enter_func(self, func):
+        pass
+
+    def leave_func(self):
+        pass
+
+    def enter_io(self, kind):
+        pass
+
+    def leave_io(self):
+        pass
+
+
+class TraceBuffer(Tracer):
+    """Keeps the last `size` events with their times in a ring buffer.
+
+    Everything is allocated up front, recording an event only stores its
+    kind, time and subject. Times are read from a monotonic clock in
+    nanoseconds.
+    """
+
+    def __init__(self, size=DEFAULT_TRACE_SIZE, clock=time.perf_counter_ns):
+        self.size = size
+        self.clock = clock
+        self.kinds = bytearray(size)
+        self.times = array('q', bytes(8 * size))
+        self.subjects = [None] * size
+        self.next = 0
+        self.wrapped = False
+
+    def add(self, kind, subject):
+        i = self.next
+        self.kinds[i] = kind
+        self.times[i] = self.clock()
+        self.subjects[i] = subject
+        i += 1
+        if i == self.size:
+            i = 0
+            self.wrapped = True
+        self.next = i
+
+    def visit_line(self, ctx):
+        self.add(LINE, ctx)
+
+    def enter_func(self, func):
+        self.add(CALL, func)
+
+    def leave_func(self):
+        self.add(RETURN, None)
+
+    def enter_io(self, kind):
+        self.add(IO, kind)
+
+    def leave_io(self):
+        self.add(IO_END, None)
+
+    def events(self):
+        """(kind, time, subject) of the events kept, oldest first"""
+        if self.wrapped:
+            indices = list(range(self.next, self.size)) + list(range(self.next))
+        else:
+            indices = range(self.next)
+        kinds, times, subjects = self.kinds, self.times, self.subjects
+        return [(kinds[i], times[i], subjects[i]) for i in indices]
+
+    def chrome_events(self):
+        # calls and I/O become begin and end events; ends whose begin was
+        # overwritten are dropped
+        events = self.events()
+        start = events[0][1] if events else 0
+        result = []
+        templates = {}  # id of a subject -> its event without the time
+        begun = []  # names and categories of the calls and I/O not ended yet
+        for kind, t, subject in events:
+            ts = (t - start) / 1000
+            if kind == RETURN or kind == IO_END:
+                if begun:
+                    name, cat = begun.pop()
+                    result.append({'name': name, 'cat': cat, 'ph': 'E', 'ts': ts, 'pid': 1, 'tid': 1})
+                continue
+
+            template = templates.get(id(subject))
+            if template is None:
+                template = templates[id(subject)] = chrome_event(kind, subject)
+            if kind != LINE:
+                begun.append((template['name'], template['cat']))
+            event = template.copy()
+            event['ts'] = ts
+            result.append(event)
+        return result
+
+    def dump(self, file):
+        """Writes the events in Chrome's trace event format"""
+        file.write(json.dumps({'traceEvents': self.chrome_events(), 'displayTimeUnit': 'ns'}))
+
+
+def chrome_event(kind, subject):
+    if kind == LINE:
+        return {'name': f'line {subject.line_no}', 'cat': 'line', 'ph': 'i', 's': 't', 'pid': 1, 'tid': 1,
+                'args': {'line': subject.line_no, 'column': line_start(subject), 'source': subject.line.strip()}}
+    if kind == CALL:
+        return {'name': function_name(subject), 'cat': 'call', 'ph': 'B', 'pid': 1, 'tid': 1,
+                'args': {'line': subject.ctx.line_no}}
+    return {'name': subject, 'cat': 'io', 'ph': 'B', 'pid': 1, 'tid': 1}